@@ -0,0 +1,188 @@
+"""Time sphinx-build on a synthetic project, with and without sphinxcontrib-trio.
+
+This generates a throwaway project with --modules modules, each containing
+--classes classes with --members methods each (plus as many module-level
+functions), cycling through all the kinds of callables that
+sphinxcontrib-trio knows how to sniff. Then it times a full build and a
+no-op rebuild at each of -j 1 .. -j --max-jobs, once with the extension
+enabled and once with plain sphinx.ext.autodoc, and writes the results as
+JSON so they can be compared between releases:
+
+    python benchmarks/build_time.py --modules 20 --output before.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import textwrap
+import subprocess
+
+# Each kind is (name, decorators, def keyword, body).
+MEMBER_KINDS = [
+    ("plain", [], "def", "pass"),
+    ("async", [], "async def", "pass"),
+    ("generator", [], "def", "yield"),
+    ("async_generator", [], "async def", "yield"),
+    ("contextmanager", ["@contextlib.contextmanager"], "def", "yield"),
+    ("asynccontextmanager", ["@contextlib.asynccontextmanager"], "async def",
+     "yield"),
+    ("classmethod", ["@classmethod"], "async def", "pass"),
+    ("staticmethod", ["@staticmethod"], "def", "yield"),
+    ("wrapped", ["@passthrough"] * 5, "async def", "pass"),
+]
+
+MODULE_HEADER = '''\
+import functools
+import contextlib
+
+
+def passthrough(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return fn(*args, **kwargs)
+    return wrapper
+
+'''
+
+
+def _define(name, kind, indent):
+    kind_name, decorators, keyword, body = kind
+    if not indent or kind_name == "staticmethod":
+        params = ""
+    elif kind_name == "classmethod":
+        params = "cls"
+    else:
+        params = "self"
+    lines = [indent + decorator for decorator in decorators]
+    lines.append("{}{} {}({}):".format(indent, keyword, name, params))
+    lines.append(indent + "    " + body)
+    return "\n".join(lines) + "\n\n"
+
+
+def generate_project(root, *, modules, classes, members, extensions):
+    """Write a project to root/src, and return that path."""
+    src = os.path.join(root, "src")
+    pkg = os.path.join(src, "benchpkg")
+    os.makedirs(pkg)
+    open(os.path.join(pkg, "__init__.py"), "w").close()
+    for m in range(modules):
+        source = [MODULE_HEADER]
+        for k in range(members):
+            kind = MEMBER_KINDS[k % len(MEMBER_KINDS)]
+            if kind[0] in ("classmethod", "staticmethod"):
+                kind = MEMBER_KINDS[0]
+            source.append(_define("func{}_{}".format(k, kind[0]), kind, ""))
+        for c in range(classes):
+            source.append("class Class{}:\n".format(c))
+            for k in range(members):
+                kind = MEMBER_KINDS[k % len(MEMBER_KINDS)]
+                source.append(
+                    _define("meth{}_{}".format(k, kind[0]), kind, "    ")
+                )
+        with open(os.path.join(pkg, "mod{}.py".format(m)), "w") as f:
+            f.write("".join(source))
+        with open(os.path.join(src, "mod{}.rst".format(m)), "w") as f:
+            f.write(textwrap.dedent("""\
+                benchpkg.mod{0}
+                ===============
+
+                .. automodule:: benchpkg.mod{0}
+                   :members:
+                   :undoc-members:
+            """.format(m)))
+    with open(os.path.join(src, "index.rst"), "w") as f:
+        f.write("Benchmark\n=========\n\n.. toctree::\n\n")
+        for m in range(modules):
+            f.write("   mod{}\n".format(m))
+    with open(os.path.join(src, "conf.py"), "w") as f:
+        f.write(textwrap.dedent("""\
+            import os, sys
+            sys.path.insert(0, os.path.abspath("."))
+            extensions = {!r}
+            # On Sphinx 9+, autodoc only uses registered documenters (like
+            # ours) in legacy mode.
+            autodoc_use_legacy_class_based = True
+        """.format(extensions)))
+    return src
+
+
+def time_build(sphinx_build, src, out, jobs):
+    start = time.perf_counter()
+    subprocess.run(
+        [sphinx_build, "-q", "-j", str(jobs), "-b", "html",
+         "-d", os.path.join(out, "doctrees"), src, os.path.join(out, "html")],
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, default=10)
+    parser.add_argument("--classes", type=int, default=5)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="build_time.json")
+    parser.add_argument("--sphinx-build", default="sphinx-build")
+    args = parser.parse_args(argv)
+
+    import sphinx
+    import sphinxcontrib_trio
+
+    results = []
+    for config, extensions in [
+        ("sphinxcontrib_trio", ["sphinx.ext.autodoc", "sphinxcontrib_trio"]),
+        ("autodoc", ["sphinx.ext.autodoc"]),
+    ]:
+        root = tempfile.mkdtemp(prefix="trio-bench-")
+        try:
+            src = generate_project(
+                root, modules=args.modules, classes=args.classes,
+                members=args.members, extensions=extensions,
+            )
+            for jobs in range(1, args.max_jobs + 1):
+                full = []
+                noop = []
+                for i in range(args.repeat):
+                    out = os.path.join(root, "out-{}-{}".format(jobs, i))
+                    full.append(time_build(args.sphinx_build, src, out, jobs))
+                    noop.append(time_build(args.sphinx_build, src, out, jobs))
+                    shutil.rmtree(out)
+                results.append(
+                    {"config": config, "jobs": jobs, "full": full, "noop": noop}
+                )
+                print("{:>20} -j{:<3} full {:7.2f}s  no-op {:7.2f}s".format(
+                    config, jobs, min(full), min(noop)
+                ))
+        finally:
+            shutil.rmtree(root)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sphinx": sphinx.__version__,
+            "sphinxcontrib_trio": sphinxcontrib_trio.__version__,
+            "modules": args.modules,
+            "classes": args.classes,
+            "members": args.members,
+            "repeat": args.repeat,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -64,35 +64,56 @@ from sphinx import addnodes
 from sphinx.domains.python import PyFunction
 from sphinx.domains.python import PyObject
 from sphinx.domains.python import PyMethod, PyClassMethod, PyStaticMethod
-from sphinx.ext.autodoc import (
-    FunctionDocumenter, MethodDocumenter, ClassLevelDocumenter, Options, ModuleLevelDocumenter
-)
 
-import inspect
-try:
-    from async_generator import isasyncgenfunction
-except ImportError:
-    from inspect import isasyncgenfunction
+import os
+import sys
+
+from . import _sniff
+from ._sniff import (
+    EXCLUSIVE_OPTIONS, sniff_options, sniff_many, resolve_wrapper_chain,
+)
+from ._state import build_state
+from ._cache import (
+    configure_caches, start_reading, purge_caches, report_caches,
+)
+from ._prefix import prefix_text, prefix_node, suffix_node
+from ._env import (
+    note_trio_object, purge_trio_objects, merge_trio_objects,
+    get_trio_options, iter_trio_objects,
+)
+from ._export import export_trio_objects
+from ._inventory import write_inventory, annotate_references
+from ._overrides import load_option_overrides
+from ._profile import (
+    profiled, start_profiling, flush_profile, purge_profile, merge_profile,
+    report_profile,
+)
 
-CM_CODES = set()
-ACM_CODES = set()
+# Names that used to live here, but are now imported on first use (see
+# __getattr__ below)
+_LAZY_NAMES = {
+    "CM_CODES": "_sniff",
+    "ACM_CODES": "_sniff",
+    "sniff_options_static": "_static",
+    "sniff_documented_object": "_autodoc",
+    "update_with_sniffed_options": "_autodoc",
+    "passthrough_option_lines": "_autodoc",
+    "ExtendedFunctionDocumenter": "_autodoc",
+    "ExtendedMethodDocumenter": "_autodoc",
+}
 
-from contextlib import contextmanager
-CM_CODES.add(contextmanager(None).__code__)  # type: ignore
 
-try:
-    from contextlib2 import contextmanager as contextmanager2
-except ImportError:
-    pass
-else:
-    CM_CODES.add(contextmanager2(None).__code__)  # type: ignore
+def __getattr__(name):
+    try:
+        modname = _LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        ) from None
+    import importlib
+    module = importlib.import_module("." + modname, __name__)
+    return getattr(module, name)
 
-try:
-    from contextlib import asynccontextmanager
-except ImportError:
-    pass
-else:
-    ACM_CODES.add(asynccontextmanager(None).__code__)  # type: ignore
 
 extended_function_option_spec = {
     "async": directives.flag,
@@ -137,44 +158,44 @@ class ExtendedCallableMixin(PyObject):  # inherit PyObject to satisfy MyPy
     # handle_signature() insert the prefix or maybe not, then we can't tell
     # where the @ goes.
     def _get_signature_prefix(self):
-        ret = ""
-        if "abstractmethod" in self.options:
-            ret += "abstractmethod "
-        # objtype checks are for backwards compatibility, to support
-        #
-        #   .. staticmethod::
-        #
-        # in addition to
-        #
-        #   .. method::
-        #      :staticmethod:
-        #
-        # it would be nice if there were a central place we could normalize
-        # the directive name into the options dict instead of having to check
-        # both here at time-of-use, but I don't understand sphinx well enough
-        # to do that.
-        #
-        # Note that this is the code that determines the ordering of the
-        # different prefixes.
-        if "staticmethod" in self.options or self.objtype == "staticmethod":
-            ret += "staticmethod "
-        if "classmethod" in self.options or self.objtype == "classmethod":
-            ret += "classmethod "
-        # if "property" in self.options:
-        #     ret += "property "
-        if "with" in self.options:
-            ret += "with "
-        if "async-with" in self.options:
-            ret += "async with "
-        for for_type, render in [("for", "for"), ("async-for", "async for")]:
-            if for_type in self.options:
-                name = self.options.get(for_type, "")
-                if not name.strip():
-                    name = "..."
-                ret += "{} {} in ".format(render, name)
-        if "async" in self.options:
-            ret += "await "
-        return ret
+        # The legacy directive names (.. staticmethod:: etc.) are normalized
+        # into the options by _get_trio_options, and the ordering of the
+        # different prefixes is determined in _prefix.py.
+        return prefix_text(self._get_trio_options())
+
+    def _get_trio_options(self):
+        # Our options as they apply to this object, including the ones implied
+        # by the legacy directive names
+        options = {}
+        for name, converter in extended_method_option_spec.items():
+            if name in self.options:
+                if converter is directives.flag:
+                    # (newer sphinx sets some of these to True itself)
+                    options[name] = None
+                else:
+                    options[name] = self.options[name]
+        if self.objtype in ["staticmethod", "classmethod"]:
+            options.setdefault(self.objtype, None)
+        if self.objtype in ["decorator", "decoratormethod"]:
+            options.setdefault("decorator", None)
+        return options
+
+    def _note_trio_object(self, name):
+        modname = self.options.get("module", self.env.ref_context.get("py:module"))
+        fullname = (modname + "." if modname else "") + name
+        state = build_state(self.env)
+        sniffed = state.pending_sniffed.pop(fullname, None)
+        obj = state.pending_objects.pop(fullname, None)
+        options = self._get_trio_options()
+        note_trio_object(self.env, self.env.docname, fullname, {
+            "objtype": self.objtype,
+            "options": options,
+            "sniffed": sorted(sniffed) if sniffed is not None else None,
+            "noindex": "noindex" in self.options or "no-index" in self.options,
+        })
+        # BuildEnvironment.events is new in Sphinx 3.0
+        events = getattr(self.env, "events", None) or self.env.app
+        events.emit("trio-options-resolved", obj, fullname, dict(options))
 
     # But we do want to override the superclass get_signature_prefix to stop
     # it from trying to do its own handling of staticmethod and classmethod
@@ -182,6 +203,7 @@ class ExtendedCallableMixin(PyObject):  # inherit PyObject to satisfy MyPy
     def get_signature_prefix(self, sig):
         return ""
 
+    @profiled("handle_signature")
     def handle_signature(self, sig, signode):
         ret = super().handle_signature(sig, signode)
 
@@ -191,18 +213,16 @@ class ExtendedCallableMixin(PyObject):  # inherit PyObject to satisfy MyPy
             signode.insert(0, addnodes.desc_addname("@", "@"))
 
         # Now that the "@" has been taken care of, we can add in the regular
-        # prefix.
-        prefix = self._get_signature_prefix()
-        if prefix:
-            signode.insert(0, addnodes.desc_annotation(prefix, prefix))
-
-        # And here's the suffix:
-        for optname in ["with", "async-with"]:
-            if self.options.get(optname, "").strip():
-                # for some reason a regular space here gets stripped, so we
-                # use U+00A0 NO-BREAK SPACE
-                s = "\u00A0as {}".format(self.options[optname])
-                signode += addnodes.desc_annotation(s, s)
+        # prefix, and the " as ..." suffix.
+        trio_options = self._get_trio_options()
+        prefix = prefix_node(trio_options)
+        if prefix is not None:
+            signode.insert(0, prefix)
+        suffix = suffix_node(trio_options)
+        if suffix is not None:
+            signode += suffix
+
+        self._note_trio_object(ret[0])
 
         return ret
 
@@ -236,153 +256,75 @@ class ExtendedPyStaticMethod(ExtendedCallableMixin, PyStaticMethod):
 
 
 ################################################################
-# Autodoc
+# Register everything
 ################################################################
 
-# Our sniffer never reports more than one item from this set. In principle
-# it's possible for something to be, say, an async function that returns
-# a context manager ("with await foo(): ..."), but it's extremely unusual, and
-# OTOH it's very easy for these to get confused when walking the __wrapped__
-# chain (e.g. because async_generator converts an async into an async-for, and
-# maybe that then gets converted into an async-with by an async version of
-# contextlib.contextmanager). So once we see one of these, we stop looking for
-# the others.
-EXCLUSIVE_OPTIONS = {"async", "for", "async-for", "with", "async-with"}
-
-
-def sniff_options(obj):
-    options = set()
-    # We walk the __wrapped__ chain to collect properties.
-    while True:
-        if getattr(obj, "__isabstractmethod__", False):
-            options.add("abstractmethod")
-        if isinstance(obj, classmethod):
-            options.add("classmethod")
-        if isinstance(obj, staticmethod):
-            options.add("staticmethod")
-        # if isinstance(obj, property):
-        #     options.add("property")
-        # Only check for these if we haven't seen any of them yet:
-        if not (options & EXCLUSIVE_OPTIONS):
-            if inspect.iscoroutinefunction(obj):
-                options.add("async")
-            # in some versions of Python, isgeneratorfunction returns true for
-            # coroutines, so we use elif
-            elif inspect.isgeneratorfunction(obj):
-                options.add("for")
-            if isasyncgenfunction(obj):
-                options.add("async-for")
-            # Some heuristics to detect when something is a context manager
-            if getattr(obj, "__code__", None) in CM_CODES:
-                options.add("with")
-            if getattr(obj, "__returns_contextmanager__", False):
-                options.add("with")
-            if getattr(obj, "__code__", None) in ACM_CODES:
-                options.add("async-with")
-            if getattr(obj, "__returns_acontextmanager__", False):
-                options.add("async-with")
-        if hasattr(obj, "__wrapped__"):
-            obj = obj.__wrapped__
-        elif hasattr(obj, "__func__"):  # for staticmethod & classmethod
-            obj = obj.__func__
-        else:
-            break
-
-    return options
-
-
-def update_with_sniffed_options(obj, option_dict):
-    if "no-auto-options" in option_dict:
+def mess_with_autodoc(app):
+    from ._autodoc import ExtendedFunctionDocumenter, ExtendedMethodDocumenter
+    app.add_autodocumenter(ExtendedFunctionDocumenter, override=True)
+    app.add_autodocumenter(ExtendedMethodDocumenter, override=True)
+    if "sphinx.ext.autosummary" in app.extensions:
+        from ._autosummary import TrioAutosummary, resolve_autosummary_prefixes
+        app.add_directive("autosummary", TrioAutosummary, override=True)
+        app.connect("doctree-resolved", resolve_autosummary_prefixes)
+
+
+def configure_sniffing(app):
+    _sniff.max_wrapper_depth = app.config.trio_max_wrapper_depth
+    _sniff.set_annotation_sniffing(app.config.trio_annotation_sniffing)
+
+
+def load_sniff_cache(app):
+    from ._persist import PersistentSniffCache, SNIFF_CACHE_FILENAME
+    cache = PersistentSniffCache(
+        os.path.join(str(app.doctreedir), SNIFF_CACHE_FILENAME)
+    )
+    if not app.config.trio_sniff_cache:
+        cache.clear()
         return
-    sniffed = sniff_options(obj)
-    for attr in sniffed:
-        # Suppose someone has a generator, and they document it as:
-        #
-        #   .. autofunction:: my_generator
-        #      :for: loop_var
-        #
-        # We don't want to blow away the existing attr["for"] = "loop_var"
-        # with our autodetected attr["for"] = None. So we use setdefault.
-        option_dict.setdefault(attr, None)
-
-
-def passthrough_option_lines(self, option_spec):
-    sourcename = self.get_sourcename()
-    for option in option_spec:
-        if option in self.options:
-            if self.options.get(option) is not None:
-                line = "   :{}: {}".format(option, self.options[option])
-            else:
-                line = "   :{}:".format(option)
-            self.add_line(line, sourcename)
-
-
-class ExtendedFunctionDocumenter(FunctionDocumenter):
-    priority = FunctionDocumenter.priority + 1
-    # You can explicitly set the options in case autodetection fails
-    option_spec = {
-        **FunctionDocumenter.option_spec,
-        **extended_function_option_spec,
-        **autodoc_option_spec,
-    }
+    cache.load()
+    build_state(app.env).sniff_cache = cache
 
-    def add_directive_header(self, sig):
-        # We can't call super() here, because we want to *skip* executing
-        # FunctionDocumenter.add_directive_header, because starting in Sphinx
-        # 2.1 it does its own sniffing, which is worse than ours and will
-        # break ours. So we jump straight to the superclass.
-        ModuleLevelDocumenter.add_directive_header(self, sig)
-        passthrough_option_lines(self, extended_function_option_spec)
-
-    def import_object(self):
-        ret = super().import_object()
-        # autodoc likes to re-use dicts here for some reason (!?!)
-        self.options = Options(self.options)
-        update_with_sniffed_options(self.object, self.options)
-        return ret
 
+def prefetch_imports(app, env, docnames):
+    # Most builds don't use this, so don't pay for importing it
+    if app.config.trio_prefetch_imports:
+        from ._prefetch import prefetch_imports
+        prefetch_imports(app, env, docnames)
 
-class ExtendedMethodDocumenter(MethodDocumenter):
-    priority = MethodDocumenter.priority + 1
-    # You can explicitly set the options in case autodetection fails
-    option_spec = {
-        **MethodDocumenter.option_spec,
-        **extended_method_option_spec,
-        **autodoc_option_spec,
-    }
 
-    def add_directive_header(self, sig):
-        # We can't call super() here, because we want to *skip* executing
-        # FunctionDocumenter.add_directive_header, because starting in Sphinx
-        # 2.1 it does its own sniffing, which is worse than ours and will
-        # break ours. So we jump straight to the superclass.
-        ClassLevelDocumenter.add_directive_header(self, sig)
-        passthrough_option_lines(self, extended_method_option_spec)
-
-    def import_object(self):
-        # MethodDocumenter overrides import_object to do some sniffing in
-        # addition to just importing. But we do our own sniffing and just want
-        # the import, so we un-override it.
-        ret = ClassLevelDocumenter.import_object(self)
-        # Use 'inspect.getattr_static' to properly detect class or static methods.
-        # This also resolves the MRO entries for subclasses.
-        obj = inspect.getattr_static(self.parent, self.object_name)
-        # autodoc likes to re-use dicts here for some reason (!?!)
-        self.options = Options(self.options)
-        update_with_sniffed_options(obj, self.options)
-        # Replicate the special ordering hacks in
-        # MethodDocumenter.import_object
-        if "classmethod" in self.options or "staticmethod" in self.options:
-            self.member_order -= 1
-        return ret
+def merge_sniff_cache_updates(app, env, docnames, other):
+    updates = getattr(other, "trio_sniff_cache_updates", None)
+    if updates:
+        env.__dict__.setdefault("trio_sniff_cache_updates", {}).update(updates)
 
-################################################################
-# Register everything
-################################################################
 
-def mess_with_autodoc(app):
-    app.add_autodocumenter(ExtendedFunctionDocumenter, override=True)
-    app.add_autodocumenter(ExtendedMethodDocumenter, override=True)
+def save_sniff_cache(app, env):
+    # Pop the updates so they don't get pickled along with the environment
+    updates = env.__dict__.pop("trio_sniff_cache_updates", None)
+    cache = build_state(env).sniff_cache
+    if cache is not None:
+        if updates:
+            cache.update(updates)
+        # Every document is accounted for in trio_objects by now, including
+        # the ones that weren't re-read this time
+        cache.prune({name for name, _, _ in iter_trio_objects(env)})
+        cache.save()
+
+
+def discard_pending(app, doctree):
+    # Whatever autodoc left for this document's directives has either been
+    # picked up by now, or never will be
+    state = build_state(app.env)
+    state.pending_sniffed.clear()
+    state.pending_objects.clear()
+
+
+def close_sniff_pool(app, exception):
+    state = build_state(app.env)
+    if state.sniff_pool is not None and state.sniff_pool.pid == os.getpid():
+        state.sniff_pool.close()
+    state.sniff_pool = None
 
 
 def setup(app):
@@ -393,8 +335,82 @@ def setup(app):
     app.add_directive_to_domain('py', 'decorator', ExtendedPyFunction)
     app.add_directive_to_domain('py', 'decoratormethod', ExtendedPyMethod)
 
+    # (Imported here, since sphinx.builders is slow to import, and only
+    # Sphinx itself ever calls this)
+    from ._lint import TrioLintBuilder
+    app.add_builder(TrioLintBuilder)
+
+    # Emitted as each function or method is documented, with the object
+    # (or None if it wasn't autodoc'ed), its fully qualified name, and its
+    # final options
+    app.add_event("trio-options-resolved")
+
     # autodoc registers things at config-inited w/o priority, so
     # take the subsequent event
     app.connect("builder-inited", mess_with_autodoc)
 
-    return {'version': __version__, 'parallel_read_safe': True}
+    app.connect("env-purge-doc", purge_trio_objects)
+    app.connect("doctree-read", discard_pending)
+    app.connect("env-merge-info", merge_trio_objects)
+
+    app.add_config_value("trio_export_objects", None, "")
+    app.connect("build-finished", export_trio_objects)
+
+    app.add_config_value("trio_write_inventory", False, "")
+    app.add_config_value("trio_intersphinx_mapping", {}, "env")
+    app.connect("build-finished", write_inventory)
+    app.connect("doctree-resolved", annotate_references)
+
+    app.add_config_value("trio_profile", False, "")
+    app.add_config_value("trio_profile_trace", "sphinxcontrib_trio-trace.json", "")
+    app.connect("builder-inited", start_profiling)
+    app.connect("doctree-read", flush_profile)
+    app.connect("env-purge-doc", purge_profile)
+    app.connect("env-merge-info", merge_profile)
+    app.connect("build-finished", report_profile)
+
+    app.add_config_value("trio_max_wrapper_depth", 100, "env")
+    app.add_config_value("trio_annotation_sniffing", False, "env")
+    app.add_config_value("trio_collapse_inherited", False, "env")
+    app.connect("builder-inited", configure_sniffing)
+
+    app.add_config_value("trio_option_overrides", {}, "env")
+    app.add_config_value("trio_option_overrides_file", None, "env")
+    app.connect("builder-inited", load_option_overrides)
+
+    app.add_config_value("trio_sniff_cache", True, "")
+    app.add_config_value("trio_static_sniffing", False, "env")
+    app.connect("builder-inited", load_sniff_cache)
+    app.connect("env-merge-info", merge_sniff_cache_updates)
+    app.connect("env-updated", save_sniff_cache)
+
+    app.add_config_value("trio_prefetch_imports", 0, "")
+    app.add_config_value("trio_prefetch_timeout", 60, "")
+    app.connect("env-before-read-docs", prefetch_imports)
+
+    app.add_config_value("trio_cache_limits", {}, "")
+    app.add_config_value("trio_cache_report", False, "")
+    app.connect("builder-inited", configure_caches)
+    app.connect("env-before-read-docs", start_reading)
+    app.connect("env-purge-doc", purge_caches)
+    app.connect("build-finished", report_caches)
+
+    app.add_config_value("trio_sniff_workers", 0, "")
+    app.add_config_value("trio_sniff_worker_max_imports", None, "")
+    app.add_config_value("trio_sniff_worker_timeout", 60, "")
+    app.connect("build-finished", close_sniff_pool)
+
+    return {
+        'version': __version__,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
+
+
+if sys.version_info < (3, 7):
+    # No module-level __getattr__ (PEP 562), so the names in _LAZY_NAMES
+    # have to be imported up front. This has to come last, since _autodoc
+    # imports things from this module.
+    for _name in _LAZY_NAMES:
+        globals()[_name] = __getattr__(_name)
+    del _name
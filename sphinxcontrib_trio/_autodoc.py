@@ -0,0 +1,287 @@
+"""Our autodoc documenters, which sniff options for autofunction/automethod.
+
+Importing sphinx.ext.autodoc is one of the slower parts of loading this
+extension, and plenty of projects only use the plain directives, so this
+module is only imported at builder-inited (when we register the
+documenters) or when someone asks for one of these names.
+"""
+
+import inspect
+
+from sphinx.ext.autodoc import (
+    FunctionDocumenter, MethodDocumenter, ClassLevelDocumenter, Options, ModuleLevelDocumenter
+)
+
+from . import (
+    extended_function_option_spec, extended_method_option_spec,
+    autodoc_option_spec,
+)
+from ._sniff import (
+    EXCLUSIVE_OPTIONS, sniff_options, sniff_table, namespace_member,
+    chain_depth, getattr_static, is_compiled_callable,
+)
+from ._static import sniff_options_static
+from ._persist import defining_module
+from ._overrides import lookup_override
+from ._state import build_state
+from ._cache import LRUCache, register_cache
+from ._workers import sniff_pool
+from ._profile import profiled
+
+
+@profiled("sniff_options", args=lambda self, obj: {"depth": chain_depth(obj)})
+def sniff_documented_object(self, obj):
+    # Like sniff_options, but for a documenter, so we know the object's
+    # qualified name and can use the persistent cache
+    state = build_state(self.env)
+    cache = state.sniff_cache
+    # Configured options skip sniffing altogether
+    sniffed = lookup_override(self.env, self.fullname)
+    if sniffed is None and self.env.config.trio_static_sniffing:
+        # Trust the source over whatever we imported, which might e.g. be a
+        # mock from autodoc_mock_imports
+        sniffed = sniff_options_static(self.modname, ".".join(self.objpath))
+    if sniffed is None:
+        if cache is None:
+            sniffed = _sniff_member(self, obj)
+        else:
+            sniffed = _sniff_via_cache(self, cache, obj)
+    # Kept for the directive that autodoc is about to generate (see
+    # _hand_over), so it can be recorded in the environment
+    self._trio_sniffed = sniffed
+    return sniffed
+
+
+def _sniff_member(self, obj):
+    # If there's a worker pool, it gets the first say (see _workers.py)
+    pool = sniff_pool(self.env)
+    if pool is not None:
+        sniffed = pool.lookup(self.modname, ".".join(self.objpath))
+        if sniffed is not None:
+            return sniffed
+    # With :members:, autodoc creates one documenter per member, so we sniff
+    # the whole parent module or class at once and share the table.
+    sniffed = None
+    if (self.parent is not None
+            and namespace_member(self.parent, self.object_name) is obj):
+        sniffed = sniff_table(self.parent).get(self.object_name)
+    if sniffed is None:
+        sniffed = frozenset(sniff_options(obj))
+    if (not sniffed & EXCLUSIVE_OPTIONS and is_compiled_callable(obj)
+            and not self.env.config.trio_static_sniffing):
+        # Compiled functions can't tell us if they're coroutines etc., but
+        # their source might still be around. (With trio_static_sniffing,
+        # we already looked.)
+        static = sniff_options_static(self.modname, ".".join(self.objpath))
+        if static is not None:
+            sniffed = sniffed | static
+    return sniffed
+
+
+def _sniff_via_cache(self, cache, obj):
+    key = (self.objtype, self.fullname)
+    # Wrappers and partials are often defined somewhere else (e.g. in
+    # functools), so the module we're documenting counts too
+    modnames = [self.modname, defining_module(obj) or self.modname]
+    sniffed = cache.lookup(key, modnames)
+    if sniffed is None:
+        sniffed = _sniff_member(self, obj)
+        stamp = cache.stamp(modnames)
+        if stamp is not None:
+            # This might be a parallel reader process, so we send new entries
+            # back through the environment, and only save them at the end.
+            updates = self.env.__dict__.setdefault("trio_sniff_cache_updates", {})
+            updates[key] = (stamp, sniffed)
+    return sniffed
+
+
+def update_with_sniffed_options(obj, option_dict, sniff=sniff_options):
+    if "no-auto-options" in option_dict:
+        return
+    sniffed = sniff(obj)
+    for attr in sniffed:
+        # Suppose someone has a generator, and they document it as:
+        #
+        #   .. autofunction:: my_generator
+        #      :for: loop_var
+        #
+        # We don't want to blow away the existing attr["for"] = "loop_var"
+        # with our autodetected attr["for"] = None. So we use setdefault.
+        option_dict.setdefault(attr, None)
+
+
+def with_sniffed_options(obj, options, sniff=sniff_options):
+    """Like update_with_sniffed_options, but copy-on-write.
+
+    autodoc hands the same options to every member documenter under
+    :members:, so we mustn't add our sniffed options to them. But most
+    members don't add anything, so we only copy when we do; returns either
+    options itself, or the updated copy.
+    """
+    if "no-auto-options" in options:
+        return options
+    sniffed = sniff(obj)
+    if all(attr in options for attr in sniffed):
+        return options
+    options = Options(options)
+    for attr in sniffed:
+        options.setdefault(attr, None)
+    return options
+
+
+# ((option, value), ...) -> the directive header lines for those options.
+# There are only a few combinations, and with :inherited-members: the same
+# ones come up over and over.
+_option_lines = register_cache("option_lines", LRUCache(maxsize=1000))
+
+
+def passthrough_option_lines(self, option_spec):
+    sourcename = self.get_sourcename()
+    key = tuple(
+        (option, self.options.get(option))
+        for option in option_spec if option in self.options
+    )
+    lines = _option_lines.get(key)
+    if lines is None:
+        lines = [
+            "   :{}: {}".format(option, value) if value is not None
+            else "   :{}:".format(option)
+            for option, value in key
+        ]
+        _option_lines.store(key, lines)
+    for line in lines:
+        self.add_line(line, sourcename)
+
+
+def _documented_members(self):
+    # {id(obj): [obj, fullname, sniffed]} for the current document
+    state = build_state(self.env)
+    docname, members = state.documented_members
+    if docname != self.env.docname:
+        members = {}
+        state.documented_members = (self.env.docname, members)
+    return members
+
+
+def _hand_over(self):
+    # Hand what we sniffed, and the object, over to the directive that
+    # autodoc is generating. This waits for the header, because autodoc
+    # still skips some of the objects it has imported (e.g. imported names
+    # under automodule :members:), and those mustn't be left behind.
+    state = build_state(self.env)
+    state.pending_sniffed[self.fullname] = self._trio_sniffed
+    state.pending_objects[self.fullname] = self._trio_object
+
+
+class ExtendedFunctionDocumenter(FunctionDocumenter):
+    priority = FunctionDocumenter.priority + 1
+    # You can explicitly set the options in case autodetection fails
+    option_spec = {
+        **FunctionDocumenter.option_spec,
+        **extended_function_option_spec,
+        **autodoc_option_spec,
+    }
+
+    # What import_object found, for _hand_over
+    _trio_sniffed = None
+    _trio_object = None
+
+    def add_directive_header(self, sig):
+        # We can't call super() here, because we want to *skip* executing
+        # FunctionDocumenter.add_directive_header, because starting in Sphinx
+        # 2.1 it does its own sniffing, which is worse than ours and will
+        # break ours. So we jump straight to the superclass.
+        ModuleLevelDocumenter.add_directive_header(self, sig)
+        passthrough_option_lines(self, extended_function_option_spec)
+        _hand_over(self)
+
+    @profiled("ExtendedFunctionDocumenter.import_object")
+    def import_object(self):
+        ret = super().import_object()
+        self.options = with_sniffed_options(
+            self.object, self.options,
+            sniff=lambda obj: sniff_documented_object(self, obj),
+        )
+        self._trio_object = self.object
+        return ret
+
+
+class ExtendedMethodDocumenter(MethodDocumenter):
+    priority = MethodDocumenter.priority + 1
+    # You can explicitly set the options in case autodetection fails
+    option_spec = {
+        **MethodDocumenter.option_spec,
+        **extended_method_option_spec,
+        **autodoc_option_spec,
+    }
+
+    # What import_object found, for _hand_over
+    _trio_sniffed = None
+    _trio_object = None
+
+    def add_directive_header(self, sig):
+        # We can't call super() here, because we want to *skip* executing
+        # FunctionDocumenter.add_directive_header, because starting in Sphinx
+        # 2.1 it does its own sniffing, which is worse than ours and will
+        # break ours. So we jump straight to the superclass.
+        ClassLevelDocumenter.add_directive_header(self, sig)
+        passthrough_option_lines(self, extended_method_option_spec)
+        _hand_over(self)
+
+    @profiled("ExtendedMethodDocumenter.import_object")
+    def import_object(self):
+        # MethodDocumenter overrides import_object to do some sniffing in
+        # addition to just importing. But we do our own sniffing and just want
+        # the import, so we un-override it.
+        ret = ClassLevelDocumenter.import_object(self)
+        # Use 'getattr_static' to properly detect class or static methods.
+        # This also resolves the MRO entries for subclasses. (Ours is
+        # inspect.getattr_static with an index per class, shared by all the
+        # methods of that class and its subclasses.)
+        if isinstance(self.parent, type):
+            obj = getattr_static(self.parent, self.object_name)
+        else:
+            obj = inspect.getattr_static(self.parent, self.object_name)
+        self.options = with_sniffed_options(
+            obj, self.options, sniff=self._sniff_once,
+        )
+        self._trio_object = obj
+        # Replicate the special ordering hacks in
+        # MethodDocumenter.import_object
+        if "classmethod" in self.options or "staticmethod" in self.options:
+            self.member_order -= 1
+        return ret
+
+    # Set to the fullname of the first entry for the same object in this
+    # document, if this entry gets collapsed into a reference to it
+    _trio_collapsed_into = None
+
+    def _sniff_once(self, obj):
+        # With :inherited-members:, the same function gets documented under
+        # every subclass, so within a document we only sniff it once. But
+        # overrides go by fullname, so they're checked for each entry, and
+        # never shared with the others.
+        sniffed = lookup_override(self.env, self.fullname)
+        if sniffed is not None:
+            self._trio_sniffed = sniffed
+            return sniffed
+        members = _documented_members(self)
+        entry = members.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            sniffed = sniff_documented_object(self, obj)
+            members[id(obj)] = [obj, self.fullname, sniffed]
+            return sniffed
+        sniffed = entry[2]
+        self._trio_sniffed = sniffed
+        if (self.env.config.trio_collapse_inherited
+                and self.object_name not in getattr(self.parent, "__dict__", {})):
+            self._trio_collapsed_into = entry[1]
+        return sniffed
+
+    def add_content(self, more_content, *args, **kwargs):
+        if self._trio_collapsed_into is None:
+            return super().add_content(more_content, *args, **kwargs)
+        self.add_line(
+            "See :py:meth:`{}`.".format(self._trio_collapsed_into),
+            self.get_sourcename(),
+        )
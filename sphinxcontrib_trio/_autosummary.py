@@ -0,0 +1,104 @@
+"""Signature prefixes in autosummary tables.
+
+With :mod:`sphinx.ext.autosummary` loaded, each row of an ``autosummary::``
+table (including the ones in pages generated by ``autosummary_generate``)
+gets the same prefix as the object's own entry, e.g. ``await fetch(url)``.
+
+autosummary has already imported each object by the time we see it, so we
+never import anything new ourselves. And most objects in a summary table are
+documented somewhere else too, so we'd rather not sniff them a second time:
+when the table is read, we only sniff the objects that haven't been
+documented yet (going through ``trio_option_overrides`` and the same caches
+as autodoc, so documenting them later is free). Then, once every document
+has been read, each row takes the options its object was finally documented
+with, wherever that was, and only falls back on what we sniffed for objects
+that aren't documented anywhere.
+"""
+
+import inspect
+from types import ModuleType
+
+from docutils import nodes
+from sphinx.ext.autosummary import Autosummary, import_by_name
+
+from ._compat import findall
+from ._env import get_trio_options
+from ._overrides import lookup_override
+from ._prefix import prefix_node, suffix_node
+from ._sniff import sniff_options
+from ._static import sniff_options_static
+
+
+class trio_autosummary_prefix(nodes.Inline, nodes.Element):
+    """Where a row's prefix goes, until every document has been read.
+
+    ``fullname`` is the object's name, and ``sniffed`` the sorted options
+    it sniffed as, or None if it was already documented.
+    """
+
+
+# Autosummary.import_by_name is new in Sphinx 3.2. Before that, we look
+# each object up again, which only finds modules that autosummary has
+# already imported.
+_RECORDS_IMPORTS = hasattr(Autosummary, "import_by_name")
+
+
+class TrioAutosummary(Autosummary):
+    def import_by_name(self, name, prefixes):
+        real_name, obj, parent, modname = super().import_by_name(name, prefixes)
+        self._trio_imported[real_name] = (obj, modname)
+        return real_name, obj, parent, modname
+
+    def run(self):
+        # real_name -> (obj, modname) for everything autosummary imported
+        self._trio_imported = {}
+        return super().run()
+
+    def _trio_sniff(self, real_name):
+        if get_trio_options(self.env, real_name) is not None:
+            return None
+        sniffed = lookup_override(self.env, real_name)
+        if sniffed is not None:
+            return sorted(sniffed)
+        obj, modname = self._trio_imported.get(real_name, (None, None))
+        if obj is None and not _RECORDS_IMPORTS:
+            try:
+                _, obj, _, modname = import_by_name(real_name)
+            except ImportError:
+                pass
+        if obj is None or isinstance(obj, ModuleType) or inspect.isclass(obj):
+            # Only functions and methods get prefixes
+            return []
+        if self.config.trio_static_sniffing:
+            sniffed = sniff_options_static(modname, real_name[len(modname) + 1:])
+            if sniffed is not None:
+                return sorted(sniffed)
+        return sorted(sniff_options(obj))
+
+    def get_table(self, items):
+        result = super().get_table(items)
+        rows = list(findall(result[-1], nodes.row))
+        for row, (_, _, _, real_name) in zip(rows, items):
+            paragraph = row[0][0]
+            paragraph.insert(0, trio_autosummary_prefix(
+                fullname=real_name, sniffed=self._trio_sniff(real_name),
+            ))
+        return result
+
+
+def resolve_autosummary_prefixes(app, doctree, docname):
+    for placeholder in list(findall(doctree, trio_autosummary_prefix)):
+        options = get_trio_options(app.env, placeholder["fullname"])
+        if options is None:
+            options = dict.fromkeys(placeholder["sniffed"] or ())
+        paragraph = placeholder.parent
+        prefix = prefix_node(options)
+        if prefix is None:
+            paragraph.remove(placeholder)
+        else:
+            placeholder.replace_self(prefix)
+        suffix = suffix_node(options)
+        if suffix is not None:
+            # The column is just the name and signature, so this goes after
+            # the signature, like in the object's own entry
+            paragraph.append(suffix)
@@ -0,0 +1,195 @@
+"""Memo tables that don't keep the objects they describe alive.
+
+Sphinx imports user code and hands us the resulting objects; we want to
+remember facts about them (e.g. their sniffed options) without pinning them
+in memory, since e.g. sphinx-autobuild re-imports the same modules over and
+over in a single long-lived process.
+
+For the same reason, every module-level cache we keep is registered here
+by name, with a cap on its size (the least recently used entries go
+first). Caches of facts about imported objects are also emptied whenever
+Sphinx starts re-reading documents it has purged, since the objects might
+have been re-imported since. ``trio_cache_limits`` overrides the caps, and
+``trio_cache_report`` logs how full each cache is at the end of the build.
+"""
+
+import weakref
+from collections import namedtuple, OrderedDict
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "currsize"])
+
+_MISSING = object()
+
+
+class _LRU:
+    # The bookkeeping shared by both kinds of cache. self._data is an
+    # OrderedDict, least recently used first.
+
+    def __init__(self, maxsize=None):
+        self._data = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def _trim(self):
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._trim()
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class WeakIdentityCache(_LRU):
+    """A mapping from objects to values, keyed on object identity.
+
+    Entries are dropped automatically when their key object is garbage
+    collected, or when there are more than maxsize of them. Objects that
+    don't support weak references (e.g. bare ``classmethod`` or
+    ``staticmethod`` wrappers) are never cached; lookups for them always
+    miss, and stores are silently ignored.
+
+    """
+
+    # self._data: id(obj) -> (weakref to obj, value)
+
+    def _evict(self, key, ref):
+        entry = self._data.get(key)
+        # The id may already have been re-used by a newer entry
+        if entry is not None and entry[0] is ref:
+            del self._data[key]
+
+    def get(self, obj, default=None):
+        key = id(obj)
+        entry = self._data.get(key)
+        if entry is not None and entry[0]() is obj:
+            self._data.move_to_end(key)
+            return entry[1]
+        return default
+
+    def lookup(self, obj, default=None):
+        # Like get(), but counts towards the hit/miss statistics
+        value = self.get(obj, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def store(self, obj, value):
+        key = id(obj)
+        try:
+            ref = weakref.ref(obj, lambda ref: self._evict(key, ref))
+        except TypeError:
+            return
+        self._data[key] = (ref, value)
+        self._data.move_to_end(key)
+        self._trim()
+
+
+class LRUCache(_LRU):
+    """A plain mapping with a size cap, for keys that are fine to keep."""
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._trim()
+
+    def setdefault(self, key, value):
+        existing = self.get(key, _MISSING)
+        if existing is not _MISSING:
+            return existing
+        self.store(key, value)
+        return value
+
+
+# name -> (cache, whether to empty it when documents are purged, its
+#          default maxsize)
+_registry = {}
+
+
+def register_cache(name, cache, purge=False):
+    """Register one of our caches under name, and return it."""
+    _registry[name] = (cache, purge, cache.maxsize)
+    return cache
+
+
+def cache_report():
+    """[(name, CacheInfo, maxsize)] for every registered cache, by name."""
+    return [
+        (name, cache.info(), cache.maxsize)
+        for name, (cache, _, _) in sorted(_registry.items())
+    ]
+
+
+def configure_caches(app):
+    from sphinx.errors import ConfigError
+
+    limits = app.config.trio_cache_limits
+    unknown = set(limits) - set(_registry)
+    if unknown:
+        raise ConfigError(
+            "trio_cache_limits: unknown cache(s) {} (expected one of {})"
+            .format(", ".join(sorted(unknown)), ", ".join(sorted(_registry)))
+        )
+    for name, (cache, _, default) in _registry.items():
+        cache.resize(limits.get(name, default))
+
+
+# Whether purge_caches has already emptied the caches for this read phase
+_purged = False
+
+
+def start_reading(app, env, docnames):
+    global _purged
+    _purged = False
+
+
+def purge_caches(app, env, docname):
+    # Sphinx purges each outdated document just before re-reading it; the
+    # first one is enough to know that modules may have been re-imported,
+    # and emptying the caches again for every document would throw away
+    # what the earlier documents just sniffed.
+    global _purged
+    if _purged:
+        return
+    _purged = True
+    for cache, purge, _ in _registry.values():
+        if purge:
+            cache.clear()
+
+
+def report_caches(app, exception):
+    if not app.config.trio_cache_report:
+        return
+    from sphinx.util import logging
+
+    logger = logging.getLogger(__name__)
+    for name, info, maxsize in cache_report():
+        logger.info(
+            "sphinxcontrib_trio cache %s: %d/%s entries, %d hits, %d misses",
+            name, info.currsize, "unlimited" if maxsize is None else maxsize,
+            info.hits, info.misses,
+        )
@@ -0,0 +1,12 @@
+"""Papering over differences between the versions of things we support."""
+
+
+def findall(node, condition):
+    """Iterate over the nodes in node's tree that match condition.
+
+    ``Node.findall`` is new in docutils 0.18, which deprecated
+    ``Node.traverse`` in its favor; older Sphinx needs older docutils.
+    """
+    if hasattr(node, "findall"):
+        return node.findall(condition)
+    return iter(node.traverse(condition))
@@ -0,0 +1,134 @@
+"""Trio metadata for every documented object, kept in the build environment.
+
+``env.trio_objects`` maps each docname to a dict mapping the fully qualified
+names of the functions and methods documented in it to records like::
+
+   {
+       "objtype": "method",
+       # Our options as they ended up on the directive, with the legacy
+       # directive names (classmethod::, decorator::, ...) normalized in
+       "options": {"async": None, "for": "item"},
+       # What autodoc sniffed, or None if nothing was sniffed
+       "sniffed": ["async"],
+       "noindex": False,
+   }
+
+Other extensions can look objects up by name with get_trio_options(), or
+listen for the ``trio-options-resolved`` event as each one is documented.
+
+Keeping the records per document makes purging and merging the results of
+parallel readers cheap. Records are never modified once they've been noted,
+and most projects only use a few distinct ones, so identical records are
+shared, which keeps the pickled environment small.
+"""
+
+from ._cache import LRUCache, register_cache
+from ._state import build_state
+
+# record key -> the shared record
+_shared_records = register_cache("shared_records", LRUCache(maxsize=5000))
+
+
+def _share(record):
+    key = (
+        record["objtype"],
+        tuple(sorted(record["options"].items())),
+        None if record["sniffed"] is None else tuple(record["sniffed"]),
+        record["noindex"],
+    )
+    return _shared_records.setdefault(key, record)
+
+
+def trio_objects(env):
+    try:
+        return env.trio_objects
+    except AttributeError:
+        # Fresh environment, or one pickled by an older version of this
+        # extension
+        env.trio_objects = {}
+        return env.trio_objects
+
+
+def _changed(env):
+    # Forget the index that get_trio_options builds
+    build_state(env).trio_object_index = None
+
+
+def _preferred(entry, old):
+    # Whether the (docname, record) entry wins over old, the same way as in
+    # iter_trio_objects: indexed entries first, then the first document
+    return (entry[1]["noindex"], entry[0]) < (old[1]["noindex"], old[0])
+
+
+def note_trio_object(env, docname, fullname, record):
+    doc_objects = trio_objects(env).setdefault(docname, {})
+    old = doc_objects.get(fullname)
+    # If an object is documented more than once, the indexed entry wins.
+    if old is None or old["noindex"] or not record["noindex"]:
+        doc_objects[fullname] = _share(record)
+    # Keep the index up to date, rather than rebuilding it for the next
+    # lookup: listeners and autosummary look objects up while reading.
+    index = build_state(env).trio_object_index
+    if index is not None:
+        entry = (docname, doc_objects[fullname])
+        old_entry = index.get(fullname)
+        if (old_entry is None or old_entry[0] == docname
+                or _preferred(entry, old_entry)):
+            index[fullname] = entry
+
+
+def iter_trio_objects(env):
+    """Yield (fullname, docname, record) for each documented object.
+
+    Objects that are documented several times are only reported once,
+    preferring their indexed entry.
+    """
+    for fullname, (docname, record) in sorted(_index_objects(env).items()):
+        yield fullname, docname, record
+
+
+def _index_objects(env):
+    # fullname -> (docname, record)
+    index = {}
+    for docname, doc_objects in sorted(trio_objects(env).items()):
+        for fullname, record in doc_objects.items():
+            old = index.get(fullname)
+            if old is None or _preferred((docname, record), old):
+                index[fullname] = (docname, record)
+    return index
+
+
+def get_trio_options(env, fullname):
+    """Return the options that fullname was documented with, or None.
+
+    The options are a new dict like ``{"async-with": "f"}``: what was
+    written in the docs plus what autodoc sniffed, with the legacy
+    directive names normalized in. If the object was documented more than
+    once, this is its indexed entry. Only objects documented with our
+    directives are known, and only once the documents that mention them
+    have been read (e.g. from ``env-updated`` or ``doctree-resolved`` on).
+    """
+    state = build_state(env)
+    index = state.trio_object_index
+    if index is None:
+        # The first query after documents are purged or merged indexes them
+        # all, so lookups don't have to go through every document
+        index = state.trio_object_index = _index_objects(env)
+    entry = index.get(fullname)
+    if entry is None:
+        return None
+    return dict(entry[1]["options"])
+
+
+def purge_trio_objects(app, env, docname):
+    _changed(env)
+    trio_objects(env).pop(docname, None)
+
+
+def merge_trio_objects(app, env, docnames, other):
+    _changed(env)
+    ours = trio_objects(env)
+    theirs = trio_objects(other)
+    for docname in docnames:
+        if docname in theirs:
+            ours[docname] = theirs[docname]
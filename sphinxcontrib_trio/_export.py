@@ -0,0 +1,56 @@
+"""Exporting what we know about every documented object as JSON Lines.
+
+Each line describes one function or method, e.g.::
+
+   {"docname": "api", "name": "pkg.open_file", "objtype": "function",
+    "options": {"async-with": "f"}, "sniffed": ["async-with"]}
+
+where ``options`` are the final options the signature was rendered with
+(what was written in the docs plus what autodoc sniffed), and ``sniffed``
+is what autodoc sniffed on its own, or null if the object wasn't
+autodoc'ed. Lines are sorted by name, so the file diffs nicely between
+releases.
+"""
+
+import os
+import json
+
+from sphinx.util import logging
+
+from ._env import iter_trio_objects
+
+logger = logging.getLogger(__name__)
+
+
+def export_record(fullname, docname, record):
+    return {
+        "name": fullname,
+        "objtype": record["objtype"],
+        "options": record["options"],
+        "sniffed": record["sniffed"],
+        "docname": docname,
+    }
+
+
+def write_trio_objects(env, path):
+    """Write one JSON object per line for each documented object to path."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    count = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for fullname, docname, record in iter_trio_objects(env):
+            json.dump(export_record(fullname, docname, record), f,
+                      sort_keys=True)
+            f.write("\n")
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def export_trio_objects(app, exception):
+    filename = app.config.trio_export_objects
+    if not filename or exception is not None:
+        return
+    path = os.path.join(str(app.outdir), filename)
+    count = write_trio_objects(app.env, path)
+    logger.info("sphinxcontrib_trio: wrote %d objects to %s", count, path)
@@ -0,0 +1,153 @@
+"""A companion to objects.inv that carries our options across projects.
+
+With ``trio_write_inventory = True``, HTML builds write ``trio-objects.inv``
+next to ``objects.inv``. It uses the same layout as a version 2 Sphinx
+inventory, a few comment lines followed by zlib-compressed lines, which
+here look like::
+
+   trio.open_file function {"async":null}
+
+i.e. the object's fully qualified name, its objtype, and its options as
+compact JSON. Only objects that have at least one of our options are listed.
+
+Projects that link to us with intersphinx can then list us in
+``trio_intersphinx_mapping``, and we'll annotate the references that
+intersphinx resolved into our docs with the prefix they'd have had in our
+signatures, without ever importing our code.
+"""
+
+import os
+import json
+import zlib
+
+from docutils import nodes
+from sphinx.util import logging
+
+from ._compat import findall
+from ._env import iter_trio_objects
+from ._prefix import prefix_text
+from ._state import build_state
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FILENAME = "trio-objects.inv"
+INVENTORY_HEADER = "# sphinxcontrib-trio inventory version 1\n"
+
+
+def dump_inventory(env, project, version):
+    """Return the contents of a trio-objects.inv for env, as bytes."""
+    lines = []
+    for fullname, _, record in iter_trio_objects(env):
+        if record["noindex"] or not record["options"]:
+            continue
+        lines.append("{} {} {}\n".format(
+            fullname, record["objtype"],
+            json.dumps(record["options"], sort_keys=True,
+                       separators=(",", ":")),
+        ))
+    header = (
+        INVENTORY_HEADER
+        + "# Project: {}\n".format(project)
+        + "# Version: {}\n".format(version)
+        + "# The remainder of this file is compressed using zlib.\n"
+    )
+    body = zlib.compress("".join(lines).encode("utf-8"), 9)
+    return header.encode("utf-8") + body
+
+
+def load_inventory(data):
+    """Parse the contents of a trio-objects.inv.
+
+    Returns a dict mapping fully qualified names to (objtype, options).
+    """
+    header = INVENTORY_HEADER.encode("utf-8")
+    if not data.startswith(header):
+        raise ValueError("not a sphinxcontrib-trio inventory")
+    # Skip the comment lines
+    pos = 0
+    for _ in range(4):
+        pos = data.index(b"\n", pos) + 1
+    table = {}
+    for line in zlib.decompress(data[pos:]).decode("utf-8").splitlines():
+        fullname, objtype, options = line.split(" ", 2)
+        table[fullname] = (objtype, json.loads(options))
+    return table
+
+
+def write_inventory(app, exception):
+    if (not app.config.trio_write_inventory or exception is not None
+            or getattr(app.builder, "format", None) != "html"):
+        return
+    path = os.path.join(str(app.outdir), INVENTORY_FILENAME)
+    data = dump_inventory(app.env, app.config.project, app.config.version)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _fetch(app, location):
+    if "://" in location:
+        from sphinx.util import requests
+        kwargs = {}
+        timeout = getattr(app.config, "intersphinx_timeout", None)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        response = requests.get(location, **kwargs)
+        response.raise_for_status()
+        return response.content
+    with open(os.path.join(str(app.srcdir), location), "rb") as f:
+        return f.read()
+
+
+def foreign_trio_objects(app):
+    """The loaded inventories, as a list of (base uri, table) pairs.
+
+    These are fetched on first use, and then kept for the rest of the build.
+    """
+    state = build_state(app.env)
+    if state.foreign_trio_objects is None:
+        loaded = []
+        for name, (uri, location) in sorted(
+                app.config.trio_intersphinx_mapping.items()):
+            if location is None:
+                location = uri.rstrip("/") + "/" + INVENTORY_FILENAME
+            try:
+                table = load_inventory(_fetch(app, location))
+            except Exception as exc:
+                logger.warning(
+                    "failed to load sphinxcontrib-trio inventory %r for %s: %s",
+                    location, name, exc, type="trio", subtype="intersphinx",
+                )
+                continue
+            loaded.append((uri, table))
+        # Longest base uri first, in case one project lives inside another
+        loaded.sort(key=lambda item: len(item[0]), reverse=True)
+        state.foreign_trio_objects = loaded
+    return state.foreign_trio_objects
+
+
+def annotate_references(app, doctree, docname):
+    if not app.config.trio_intersphinx_mapping:
+        return
+    inventories = None
+    for ref in findall(doctree, nodes.reference):
+        refuri = ref.get("refuri", "")
+        if ref.get("internal") or "#" not in refuri:
+            continue
+        if inventories is None:
+            inventories = foreign_trio_objects(app)
+        for uri, table in inventories:
+            if not refuri.startswith(uri):
+                continue
+            fullname = refuri.rsplit("#", 1)[1]
+            if fullname in table:
+                _, options = table[fullname]
+                title = prefix_text(options) + fullname
+                if ref.get("reftitle"):
+                    title += " " + ref["reftitle"]
+                ref["reftitle"] = title
+                ref["classes"].extend(
+                    "trio-" + option for option in sorted(options)
+                )
+            break
@@ -0,0 +1,150 @@
+"""The trio-lint builder: check documented options against sniffed ones.
+
+``sphinx-build -b trio-lint`` reads the docs like any other build (in
+parallel under ``-j``), but writes nothing. At the end, for each documented
+function and method it compares the options the docs give it with what
+sniffing says, and warns about any mismatches, e.g.::
+
+   api.rst: WARNING: pkg.fetch is documented as (none), but sniffs as :async: [trio.lint]
+
+Objects documented with autodoc are compared with what autodoc sniffed;
+everything else (plain ``.. function::`` directives, and autodoc with
+``:no-auto-options:``) is imported and sniffed here, unless
+``trio_option_overrides`` says what it is. Objects that can't be imported
+are skipped.
+
+Documenting something with an option that sniffing can't confirm is how
+you tell us about wrappers that sniffing can't see through, so that's only
+reported when sniffing positively found a different one.
+"""
+
+import importlib
+
+from sphinx.builders import Builder
+from sphinx.util import logging
+
+from ._env import iter_trio_objects
+from ._overrides import lookup_override
+from ._sniff import (
+    EXCLUSIVE_OPTIONS, SNIFFABLE_OPTIONS, sniff_options, getattr_static,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def import_documented_object(fullname):
+    """Import an object by its fully qualified name, or return None.
+
+    Class attributes are looked up statically, so that classmethod and
+    staticmethod objects come back as themselves.
+    """
+    parts = fullname.split(".")
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module(".".join(parts[:i]))
+        except Exception:
+            continue
+        break
+    else:
+        return None
+    try:
+        for name in parts[i:]:
+            if isinstance(obj, type):
+                obj = getattr_static(obj, name)
+            else:
+                obj = getattr(obj, name)
+    except Exception:
+        return None
+    return obj
+
+
+def compare_options(documented, sniffed):
+    """Return (missing, unconfirmed) sets of options, or None if they agree.
+
+    missing are sniffed but not documented; unconfirmed are documented, but
+    sniffing found something else.
+    """
+    documented = set(documented) & SNIFFABLE_OPTIONS
+    sniffed = set(sniffed)
+    missing = sniffed - documented
+    unconfirmed = documented - sniffed
+    if not sniffed & EXCLUSIVE_OPTIONS:
+        # Sniffing might just not be able to see what this is
+        unconfirmed -= EXCLUSIVE_OPTIONS
+    if not missing and not unconfirmed:
+        return None
+    return missing, unconfirmed
+
+
+def _format_options(options):
+    if not options:
+        return "(none)"
+    return " ".join(":{}:".format(option) for option in sorted(options))
+
+
+class TrioLintBuilder(Builder):
+    name = "trio-lint"
+    epilog = "Checked the trio options of every documented object."
+
+    allow_parallel = True
+
+    def init(self):
+        # One dict per mismatch, in the order they were reported
+        self.mismatches = []
+
+    def get_outdated_docs(self):
+        return self.env.found_docs
+
+    def get_target_uri(self, docname, typ=None):
+        return ""
+
+    def prepare_writing(self, docnames):
+        pass
+
+    def write_documents(self, docnames):
+        # Nothing to write, so don't even bother resolving the doctrees
+        pass
+
+    def write_doc(self, docname, doctree):
+        pass
+
+    def finish(self):
+        checked = 0
+        for fullname, docname, record in iter_trio_objects(self.env):
+            sniffed = record["sniffed"]
+            if sniffed is None:
+                sniffed = lookup_override(self.env, fullname)
+            if sniffed is None:
+                obj = import_documented_object(fullname)
+                if obj is None:
+                    logger.debug(
+                        "[sphinxcontrib_trio] trio-lint: can't import %s",
+                        fullname,
+                    )
+                    continue
+                sniffed = sniff_options(obj)
+            checked += 1
+            result = compare_options(record["options"], sniffed)
+            if result is None:
+                continue
+            missing, unconfirmed = result
+            documented = set(record["options"]) & SNIFFABLE_OPTIONS
+            self.mismatches.append({
+                "name": fullname,
+                "docname": docname,
+                "objtype": record["objtype"],
+                "documented": sorted(documented),
+                "sniffed": sorted(sniffed),
+                "missing": sorted(missing),
+                "unconfirmed": sorted(unconfirmed),
+            })
+            logger.warning(
+                "%s is documented as %s, but sniffs as %s",
+                fullname, _format_options(documented),
+                _format_options(sniffed),
+                location=docname, type="trio", subtype="lint",
+            )
+        logger.info(
+            "trio-lint: checked %d objects, found %d mismatches",
+            checked, len(self.mismatches),
+        )
@@ -0,0 +1,145 @@
+"""Options that are known in advance, so there's no need to sniff for them.
+
+``trio_option_overrides`` in ``conf.py`` (and/or the file named by
+``trio_option_overrides_file``) maps fully qualified names, or
+:mod:`fnmatch`-style patterns, to lists of options::
+
+   trio_option_overrides = {
+       "mylib._bindings.open_stream": ["async-with"],
+       "mylib._bindings.Connection.*": ["async"],
+   }
+
+Anything that matches gets exactly those options, without being sniffed.
+Exact names win over patterns, and a pattern that starts with more literal
+dotted components wins over one with fewer (``pkg.sub.*`` beats
+``pkg.*``); between patterns with as many, the first one listed wins.
+
+There can be thousands of these, so we don't try every pattern against
+every name. Exact names go in a dict, and each pattern goes in a trie keyed
+on the dotted components before its first wildcard, so a lookup only tries
+the patterns along the path to the name it's looking up.
+"""
+
+import os
+import json
+from fnmatch import fnmatchcase
+
+from sphinx.errors import ConfigError
+
+from ._sniff import SNIFFABLE_OPTIONS
+from ._state import build_state
+
+_GLOB_CHARS = frozenset("*?[")
+
+
+class _Node:
+    __slots__ = ("children", "patterns")
+
+    def __init__(self):
+        # dotted component -> _Node
+        self.children = {}
+        # [(pattern, options)] whose literal prefix ends here
+        self.patterns = []
+
+
+class OptionOverrides:
+    def __init__(self):
+        self.exact = {}
+        self._root = _Node()
+
+    def add(self, pattern, options):
+        if not _GLOB_CHARS.intersection(pattern):
+            self.exact[pattern] = options
+            return
+        node = self._root
+        for part in pattern.split("."):
+            if _GLOB_CHARS.intersection(part):
+                break
+            node = node.children.setdefault(part, _Node())
+        node.patterns.append((pattern, options))
+
+    def lookup(self, fullname):
+        """The options for fullname, as a frozenset, or None."""
+        options = self.exact.get(fullname)
+        if options is not None:
+            return options
+        found = None
+        node = self._root
+        for part in [None] + fullname.split("."):
+            if part is not None:
+                node = node.children.get(part)
+                if node is None:
+                    break
+            for pattern, options in node.patterns:
+                if fnmatchcase(fullname, pattern):
+                    # Keep going; deeper matches are more specific
+                    found = options
+                    break
+        return found
+
+
+def _load_file(path):
+    if path.endswith(".toml"):
+        # Only imported when needed, since it takes a while
+        try:
+            import tomllib
+        except ImportError:  # pragma: no cover
+            try:
+                import tomli as tomllib  # type: ignore
+            except ImportError:
+                raise ConfigError(
+                    "reading {} needs Python 3.11+ or the tomli package"
+                    .format(path)
+                )
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _parse_options(pattern, options):
+    if isinstance(options, str):
+        options = [options]
+    options = frozenset(options)
+    unknown = options - SNIFFABLE_OPTIONS
+    if unknown:
+        raise ConfigError(
+            "trio_option_overrides: unknown option(s) {} for {!r}".format(
+                ", ".join(sorted(unknown)), pattern
+            )
+        )
+    return options
+
+
+def build_overrides(table):
+    """Build an OptionOverrides from a {pattern: options} mapping."""
+    overrides = OptionOverrides()
+    for pattern, options in table.items():
+        overrides.add(pattern, _parse_options(pattern, options))
+    return overrides
+
+
+def load_option_overrides(app):
+    table = {}
+    filename = app.config.trio_option_overrides_file
+    if filename:
+        path = os.path.join(str(app.confdir), filename)
+        try:
+            table.update(_load_file(path))
+        except (OSError, ValueError) as exc:
+            raise ConfigError(
+                "can't read trio_option_overrides_file {}: {}".format(path, exc)
+            )
+    # conf.py gets the last word
+    table.update(app.config.trio_option_overrides)
+    build_state(app.env).option_overrides = (
+        build_overrides(table) if table else None
+    )
+
+
+def lookup_override(env, fullname):
+    """The configured options for fullname, or None if there aren't any."""
+    overrides = build_state(env).option_overrides
+    if overrides is None:
+        return None
+    return overrides.lookup(fullname)
@@ -0,0 +1,129 @@
+"""An on-disk cache of sniffed options, reused across sphinx-build runs.
+
+Entries are keyed on the documented object's objtype and fully qualified
+name, and stamped with the mtime and size of both the module it's
+documented in and the module that defines the sniffed object (which, for
+``functools.partial`` objects or decorated functions, might be somewhere
+else entirely). If either module changes, the entry is ignored (and
+eventually overwritten). Entries for objects that aren't documented any
+more are dropped whenever the file is saved. The whole file is thrown away
+if it was written by a version of this code with different sniffing
+heuristics.
+"""
+
+import os
+import sys
+import pickle
+
+from . import _sniff
+from ._sniff import EXCLUSIVE_OPTIONS
+
+# Bump this whenever the sniffing heuristics change in a way that could
+# change their results.
+SNIFF_CACHE_VERSION = 2
+
+SNIFF_CACHE_FILENAME = "sphinxcontrib_trio-sniffed.pickle"
+
+
+def _fingerprint():
+    return (
+        SNIFF_CACHE_VERSION,
+        tuple(sorted(EXCLUSIVE_OPTIONS)),
+        _sniff.annotation_sniffing,
+    )
+
+
+def defining_module(obj):
+    # classmethod and staticmethod objects only grew __module__ in 3.10
+    modname = getattr(obj, "__module__", None)
+    if modname is None:
+        modname = getattr(getattr(obj, "__func__", None), "__module__", None)
+    return modname
+
+
+class PersistentSniffCache:
+    def __init__(self, path):
+        self.path = path
+        # (objtype, qualname) -> (stamp, frozenset of options)
+        self.entries = {}
+        # modname -> stamp; source files aren't going to change under us
+        # during a single build, so we only stat each one once.
+        self._stamps = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                fingerprint, entries = pickle.load(f)
+        except Exception:
+            # Missing, truncated, or from some incompatible version -- in any
+            # case, start over.
+            return
+        if fingerprint == _fingerprint():
+            self.entries = entries
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                (_fingerprint(), self.entries), f, pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def clear(self):
+        self.entries = {}
+        self.dirty = False
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _module_stamp(self, modname):
+        try:
+            return self._stamps[modname]
+        except KeyError:
+            pass
+        stamp = None
+        filename = getattr(sys.modules.get(modname), "__file__", None)
+        if filename:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                pass
+            else:
+                stamp = (filename, st.st_mtime_ns, st.st_size)
+        self._stamps[modname] = stamp
+        return stamp
+
+    def stamp(self, modnames):
+        # One stamp for each of modnames that has a file, or None if none do
+        stamps = tuple(
+            stamp for stamp in map(self._module_stamp, sorted(set(modnames)))
+            if stamp is not None
+        )
+        return stamps or None
+
+    def lookup(self, key, modnames):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stamp, options = entry
+        if stamp is None or stamp != self.stamp(modnames):
+            return None
+        return options
+
+    def update(self, entries):
+        self.entries.update(entries)
+        self.dirty = True
+
+    def prune(self, fullnames):
+        # Forget the objects that aren't documented anywhere any more
+        stale = [key for key in self.entries if key[1] not in fullnames]
+        for key in stale:
+            del self.entries[key]
+        if stale:
+            self.dirty = True
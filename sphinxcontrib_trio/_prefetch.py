@@ -0,0 +1,173 @@
+"""Importing the modules that autodoc will need before reading starts.
+
+Normally each module gets imported when the first ``auto*::`` directive
+that needs it runs, one at a time. With ``trio_prefetch_imports = N``, we
+skim the documents that are about to be read for ``auto*::`` targets
+(along with any ``module::`` and ``currentmodule::`` directives, for
+context), and import all those modules up front on N threads. That helps
+when imports spend their time waiting on I/O, e.g. loading big data files
+or extension modules off network storage. By the time the documenters get
+to them, they're already in ``sys.modules``.
+
+Import errors are only logged at debug level. autodoc imports the module
+again when it gets to it, and reports the error the usual way. (Some of
+these errors are our own doing, too: importing modules with circular
+imports on several threads at once can fail with a deadlock error that a
+plain import wouldn't hit.) A module that's still importing after ``trio_prefetch_timeout``
+seconds is reported and left to finish in the background; we don't wait
+for it, and the documenter that needs it will wait on the import lock
+instead. Except with ``-j``: forking the parallel readers while another
+thread holds a module's import lock would leave any reader that imports
+that module hanging forever, so then we wait for every import to finish
+before reading starts.
+"""
+
+import re
+import sys
+import time
+import importlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+_DIRECTIVE = re.compile(
+    r"^[ \t]*\.\.[ \t]+(?:py:)?(auto\w+|module|currentmodule)::[ \t]*(\S*)",
+    re.MULTILINE,
+)
+
+
+def modules_to_prefetch(source):
+    """The names of the modules that the auto*:: directives in source need.
+
+    Some of them might name classes or functions instead (e.g. for
+    ``autoclass:: pkg.Class.Inner``); prefetch_modules sorts that out.
+    """
+    found = set()
+    current = None
+    for directive, target in _DIRECTIVE.findall(source):
+        target = target.split("(")[0].replace("::", ".")
+        if directive in ("module", "currentmodule"):
+            current = None if target in ("", "None") else target
+        elif directive == "automodule":
+            if target:
+                found.add(target)
+        elif directive.startswith("auto") and target:
+            if "." in target:
+                found.add(target.rpartition(".")[0])
+            if current is not None:
+                found.add(current)
+    return found
+
+
+def _import(modname, started):
+    started[modname] = time.monotonic()
+    name = modname
+    while True:
+        try:
+            importlib.import_module(name)
+            return None
+        except ModuleNotFoundError as exc:
+            # pkg.Class isn't a module, but pkg might be
+            if "." in name and exc.name == name:
+                name = name.rpartition(".")[0]
+                continue
+            return exc
+        except (Exception, SystemExit) as exc:
+            return exc
+
+
+def prefetch_modules(modnames, threads, timeout, finish=False):
+    """Import modnames on a pool of threads.
+
+    Returns ({modname: exception} for the imports that failed, [modnames
+    that were still importing after timeout seconds]). Those are left to
+    finish in the background, unless finish is true, in which case we wait
+    for them (but still report them).
+    """
+    todo = sorted(name for name in modnames if name not in sys.modules)
+    errors = {}
+    timed_out = []
+    if not todo:
+        return errors, timed_out
+    # modname -> when its import started
+    started = {}
+    executor = ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="trio-prefetch"
+    )
+    try:
+        pending = {
+            executor.submit(_import, name, started): name for name in todo
+        }
+        while pending:
+            now = time.monotonic()
+            waiting = timeout
+            for future, name in list(pending.items()):
+                if name in started:
+                    left = started[name] + timeout - now
+                    if left <= 0:
+                        timed_out.append(name)
+                        del pending[future]
+                    else:
+                        waiting = min(waiting, left)
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                exc = future.result()
+                if exc is not None:
+                    errors[name] = exc
+    finally:
+        # Don't wait for the imports that timed out, unless asked to
+        executor.shutdown(wait=finish)
+    return errors, sorted(timed_out)
+
+
+def prefetch_imports(app, env, docnames):
+    threads = app.config.trio_prefetch_imports
+    if not threads or not docnames:
+        return
+    modnames = set()
+    for docname in docnames:
+        try:
+            with open(env.doc2path(docname), encoding=app.config.source_encoding) as f:
+                modnames |= modules_to_prefetch(f.read())
+        except (OSError, UnicodeDecodeError):
+            continue
+    mocked = getattr(app.config, "autodoc_mock_imports", None)
+    timeout = app.config.trio_prefetch_timeout
+    # Parallel readers get forked, so nothing can still be importing then
+    finish = app.parallel > 1
+    start = time.perf_counter()
+    if mocked:
+        # Import things the way autodoc will
+        from sphinx.ext.autodoc.mock import mock
+        with mock(mocked):
+            errors, timed_out = prefetch_modules(
+                modnames, threads, timeout, finish=finish
+            )
+    else:
+        errors, timed_out = prefetch_modules(
+            modnames, threads, timeout, finish=finish
+        )
+    for modname, exc in sorted(errors.items()):
+        # autodoc tries again, and reports it if it still fails
+        logger.debug(
+            "[sphinxcontrib_trio] prefetching %s failed: %s: %s",
+            modname, type(exc).__name__, exc,
+        )
+    for modname in timed_out:
+        logger.warning(
+            "sphinxcontrib_trio: still importing %s after %s seconds; %s "
+            "(see trio_prefetch_timeout)",
+            modname, timeout,
+            "waited for it, since parallel readers can't be started while "
+            "it imports" if finish else "carrying on without it",
+            type="trio", subtype="prefetch",
+        )
+    logger.info(
+        "sphinxcontrib_trio: prefetching imports took %.2f seconds",
+        time.perf_counter() - start,
+    )
@@ -0,0 +1,85 @@
+"""Rendering our options into signature prefixes and suffixes.
+
+There are only a handful of distinct option combinations in any given
+project, so we work out the prefix and suffix strings for each combination
+once, and every signature that uses it shares those same string objects.
+Pickle only stores each of them once per doctree, rather than once per
+signature.
+
+Each prefix or suffix is a single annotation node holding a single text
+node, like before: Sphinx's structured keyword and name nodes would about
+double what each signature costs in the pickled doctree.
+"""
+
+from sphinx import addnodes
+
+from ._cache import LRUCache, register_cache
+
+# combination of options -> (prefix text, suffix text)
+_strings = register_cache("prefix_strings", LRUCache(maxsize=1000))
+
+
+def _text_for(options):
+    prefix = []
+    if "abstractmethod" in options:
+        prefix.append("abstractmethod")
+    # Note that this is the code that determines the ordering of the
+    # different prefixes.
+    if "staticmethod" in options:
+        prefix.append("staticmethod")
+    if "classmethod" in options:
+        prefix.append("classmethod")
+    # if "property" in options:
+    #     prefix.append("property")
+    if "with" in options:
+        prefix.append("with")
+    if "async-with" in options:
+        prefix.append("async with")
+    for for_type, render in [("for", "for"), ("async-for", "async for")]:
+        if for_type in options:
+            name = options.get(for_type) or ""
+            if not name.strip():
+                name = "..."
+            prefix += [render, name, "in"]
+    if "async" in options:
+        prefix.append("await")
+
+    suffix = ""
+    for optname in ["with", "async-with"]:
+        name = (options.get(optname) or "").strip()
+        if name:
+            # for some reason a regular space here gets stripped, so we use
+            # U+00A0 NO-BREAK SPACE
+            suffix += "\u00A0as {}".format(options[optname])
+    return "".join(word + " " for word in prefix), suffix
+
+
+def _strings_for(options):
+    key = tuple(sorted(options.items(), key=lambda item: item[0]))
+    strings = _strings.get(key)
+    if strings is None:
+        strings = _text_for(options)
+        _strings.store(key, strings)
+    return strings
+
+
+def prefix_text(options):
+    """The signature prefix for these options, as plain text."""
+    prefix, _ = _strings_for(options)
+    return prefix
+
+
+def prefix_node(options):
+    """A desc_annotation node for the signature prefix, or None."""
+    prefix, _ = _strings_for(options)
+    if not prefix:
+        return None
+    return addnodes.desc_annotation(prefix, prefix)
+
+
+def suffix_node(options):
+    """A desc_annotation node for the " as ..." suffix, or None."""
+    _, suffix = _strings_for(options)
+    if not suffix:
+        return None
+    return addnodes.desc_annotation(suffix, suffix)
@@ -0,0 +1,178 @@
+"""Opt-in timing of our hot paths (``trio_profile = True`` in conf.py).
+
+Timed calls are collected in the process that makes them, and flushed into
+``env.trio_profile`` (keyed by docname) after each document is read, so
+that results from parallel reader processes come back with the rest of the
+environment. At build-finished we log a summary table and write a Chrome
+trace-event file (load it in chrome://tracing or https://ui.perfetto.dev).
+"""
+
+import os
+import json
+import math
+import time
+import functools
+import threading
+from collections import Counter
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# The Profiler for the current build, or None if profiling is disabled.
+_active = None
+
+
+class Profiler:
+    def __init__(self):
+        # Events since the last flush, as (name, ts, dur, tid, args) with times
+        # in microseconds
+        self.events = []
+
+    def record(self, name, start, end, args=None):
+        self.events.append((
+            name, start * 1e6, (end - start) * 1e6, threading.get_ident(), args,
+        ))
+
+    def flush(self):
+        events, self.events = self.events, []
+        return events
+
+
+def profiled(name, args=None):
+    """Decorator: time calls to the decorated function when profiling.
+
+    If given, ``args(*call_args)`` is called to compute extra information
+    to attach to the event.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*call_args, **call_kwargs):
+            profiler = _active
+            if profiler is None:
+                return fn(*call_args, **call_kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*call_args, **call_kwargs)
+            finally:
+                end = time.perf_counter()
+                profiler.record(
+                    name, start, end, args(*call_args) if args else None
+                )
+        return wrapper
+    return decorator
+
+
+def _profile_data(env):
+    try:
+        return env.trio_profile
+    except AttributeError:
+        env.trio_profile = {}
+        return env.trio_profile
+
+
+def start_profiling(app):
+    global _active
+    if not app.config.trio_profile:
+        _active = None
+        # Don't keep pickling the events from an earlier profiled build
+        app.env.__dict__.pop("trio_profile", None)
+        return
+    _active = Profiler()
+    # Only report on what happens in this build
+    app.env.trio_profile = {}
+
+
+def flush_profile(app, doctree):
+    if _active is not None:
+        _profile_data(app.env)[app.env.docname] = (
+            os.getpid(), _active.flush()
+        )
+
+
+def purge_profile(app, env, docname):
+    if _active is not None:
+        _profile_data(env).pop(docname, None)
+
+
+def merge_profile(app, env, docnames, other):
+    if _active is None:
+        return
+    ours = _profile_data(env)
+    theirs = _profile_data(other)
+    for docname in docnames:
+        if docname in theirs:
+            ours[docname] = theirs[docname]
+
+
+def _percentile(sorted_values, fraction):
+    # Nearest-rank: the smallest value that at least fraction of them are <=
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(profile):
+    """Aggregate flushed events into per-name stats and depth histograms."""
+    durations = {}
+    depths = {}
+    for _, events in profile.values():
+        for name, _, dur, _, args in events:
+            durations.setdefault(name, []).append(dur)
+            if args and "depth" in args:
+                depths.setdefault(name, Counter())[args["depth"]] += 1
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "total_ms": sum(values) / 1e3,
+            "mean_ms": sum(values) / len(values) / 1e3,
+            "p99_ms": _percentile(values, 0.99) / 1e3,
+            "max_ms": values[-1] / 1e3,
+        }
+    return stats, depths
+
+
+def chrome_trace(profile):
+    trace_events = []
+    for docname, (pid, events) in sorted(profile.items()):
+        for name, ts, dur, tid, args in events:
+            trace_events.append({
+                "name": name,
+                "cat": "sphinxcontrib_trio",
+                "ph": "X",
+                "ts": ts,
+                "dur": dur,
+                "pid": pid,
+                "tid": tid,
+                "args": dict(args or {}, docname=docname),
+            })
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def report_profile(app, exception):
+    if _active is None or exception is not None:
+        return
+    profile = _profile_data(app.env)
+    stats, depths = summarize(profile)
+    lines = [
+        "sphinxcontrib_trio profile:",
+        "{:<42} {:>8} {:>12} {:>10} {:>10} {:>10}".format(
+            "", "count", "total ms", "mean ms", "p99 ms", "max ms"
+        ),
+    ]
+    for name, s in sorted(stats.items()):
+        lines.append(
+            "{:<42} {count:>8} {total_ms:>12.2f} {mean_ms:>10.3f} "
+            "{p99_ms:>10.3f} {max_ms:>10.3f}".format(name, **s)
+        )
+    for name, histogram in sorted(depths.items()):
+        lines.append("{} wrapper chain depths:".format(name))
+        for depth, count in sorted(histogram.items()):
+            lines.append("  {:>4}: {}".format(depth, count))
+    logger.info("\n".join(lines))
+
+    path = os.path.join(str(app.outdir), app.config.trio_profile_trace)
+    with open(path, "w") as f:
+        json.dump(chrome_trace(profile), f)
+    logger.info("sphinxcontrib_trio: wrote trace to %s", path)
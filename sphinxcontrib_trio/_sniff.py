@@ -0,0 +1,596 @@
+"""Figuring out which of our options apply to a given Python object."""
+
+import re
+import sys
+import types
+import inspect
+import functools
+from types import CodeType
+
+try:
+    import annotationlib
+except ImportError:
+    annotationlib = None  # type: ignore
+
+from sphinx.util import logging
+
+from ._cache import WeakIdentityCache, register_cache
+
+logger = logging.getLogger(__name__)
+
+# The code objects of the functions that contextlib.contextmanager & co. wrap
+# things in, so we can recognize their wrappers. These mean importing the
+# optional libraries, so they're only computed when first needed; use
+# _context_manager_codes() (or the CM_CODES / ACM_CODES module attributes).
+_codes = None
+
+
+def _context_manager_codes():
+    global _codes
+    if _codes is None:
+        cm_codes = set()
+        acm_codes = set()
+
+        from contextlib import contextmanager
+        cm_codes.add(contextmanager(None).__code__)  # type: ignore
+
+        try:
+            from contextlib2 import contextmanager as contextmanager2
+        except ImportError:
+            pass
+        else:
+            cm_codes.add(contextmanager2(None).__code__)  # type: ignore
+
+        try:
+            from contextlib import asynccontextmanager
+        except ImportError:
+            pass
+        else:
+            acm_codes.add(asynccontextmanager(None).__code__)  # type: ignore
+
+        _codes = (cm_codes, acm_codes)
+    return _codes
+
+
+def __getattr__(name):
+    if name == "CM_CODES":
+        return _context_manager_codes()[0]
+    if name == "ACM_CODES":
+        return _context_manager_codes()[1]
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
+
+if sys.version_info < (3, 7):
+    # No module-level __getattr__ (PEP 562), so compute them up front
+    CM_CODES, ACM_CODES = _context_manager_codes()
+
+
+# Our sniffer never reports more than one item from this set. In principle
+# it's possible for something to be, say, an async function that returns
+# a context manager ("with await foo(): ..."), but it's extremely unusual, and
+# OTOH it's very easy for these to get confused when walking the __wrapped__
+# chain (e.g. because async_generator converts an async into an async-for, and
+# maybe that then gets converted into an async-with by an async version of
+# contextlib.contextmanager). So once we see one of these, we stop looking for
+# the others.
+EXCLUSIVE_OPTIONS = {"async", "for", "async-for", "with", "async-with"}
+
+# Everything that sniffing can ever report
+SNIFFABLE_OPTIONS = EXCLUSIVE_OPTIONS | {
+    "abstractmethod", "classmethod", "staticmethod",
+}
+
+# From Include/cpython/code.h; these have been stable since 3.6.
+CO_GENERATOR = 0x0020
+CO_COROUTINE = 0x0080
+CO_ASYNC_GENERATOR = 0x0200
+_FLAGS_MASK = CO_GENERATOR | CO_COROUTINE | CO_ASYNC_GENERATOR
+
+# Set by inspect.markcoroutinefunction (3.12+)
+_COROUTINE_MARK = getattr(inspect, "_is_coroutine_mark", object())
+
+
+def _is_asyncio_coroutine_marker(marker):
+    # Cython's compiled async functions (and old @asyncio.coroutine ones) set
+    # _is_coroutine to asyncio's marker object, or to True where asyncio no
+    # longer has one. We only compare against asyncio's marker if something
+    # has imported it already.
+    if marker is None:
+        return False
+    if marker is True:
+        return True
+    coroutines = sys.modules.get("asyncio.coroutines")
+    return (coroutines is not None
+            and marker is getattr(coroutines, "_is_coroutine", None))
+
+
+# The types of functions and methods implemented in C (or compiled to it by
+# mypyc), which don't have a __code__ for us to look at. Cython's functions
+# don't have a type we can import, so we go by its name.
+# (Python 3.6 doesn't have all of these in the types module.)
+_COMPILED_TYPES = (types.BuiltinFunctionType,) + tuple(
+    t for t in (
+        getattr(types, "MethodDescriptorType", None),
+        getattr(types, "ClassMethodDescriptorType", None),
+        getattr(types, "WrapperDescriptorType", None),
+    ) if t is not None
+)
+_CLASSMETHOD_TYPES = (classmethod,) + tuple(
+    t for t in [getattr(types, "ClassMethodDescriptorType", None)]
+    if t is not None
+)
+_CYTHON_TYPE_NAMES = {"cython_function_or_method", "fused_cython_function"}
+
+
+def is_compiled_callable(obj):
+    """Whether obj's wrapper chain ends in a compiled function.
+
+    Those can't tell us whether they're generators or coroutines, so it can
+    be worth looking for their source instead.
+    """
+    for link in _iter_chain(obj, warn=False):
+        if isinstance(link, (staticmethod, classmethod)):
+            continue
+        if (isinstance(link, _COMPILED_TYPES)
+                or type(link).__name__ in _CYTHON_TYPE_NAMES):
+            return True
+    return False
+
+
+def _options_for_flags(flags):
+    options = set()
+    # in some versions of Python, generator functions and coroutines can both
+    # have CO_GENERATOR set, so we use elif (like the old
+    # isgeneratorfunction-based code did)
+    if flags & CO_COROUTINE:
+        options.add("async")
+    elif flags & CO_GENERATOR:
+        options.add("for")
+    if flags & CO_ASYNC_GENERATOR:
+        options.add("async-for")
+    return frozenset(options)
+
+
+# Every possible combination of the code flags we care about, precomputed, so
+# classifying a code object is a single table lookup.
+_FLAG_OPTIONS = {
+    flags: _options_for_flags(flags)
+    for flags in range(_FLAGS_MASK + 1)
+    if not flags & ~_FLAGS_MASK
+}
+
+
+# Whether to look at return annotations, for wrappers that hide everything
+# else. Set from the trio_annotation_sniffing config value, via
+# set_annotation_sniffing.
+annotation_sniffing = False
+
+# The last component of a return annotation's name -> the option it implies.
+# (We leave out Iterable and AsyncIterable, because plenty of functions that
+# return lists and the like are annotated with those.)
+ANNOTATION_OPTIONS = {
+    "Awaitable": "async",
+    "Coroutine": "async",
+    "Iterator": "for",
+    "Generator": "for",
+    "AsyncIterator": "async-for",
+    "AsyncGenerator": "async-for",
+    "ContextManager": "with",
+    "AbstractContextManager": "with",
+    "AsyncContextManager": "async-with",
+    "AbstractAsyncContextManager": "async-with",
+}
+
+_ANNOTATION_NAME = re.compile(r"\s*([\w.]+)")
+
+
+def _raw_return_annotation(func):
+    # Never evaluate anything: on 3.14+ we ask for the annotations as
+    # strings, and before that they're either already evaluated, or strings
+    # (with "from __future__ import annotations").
+    try:
+        if annotationlib is not None:
+            annotations = annotationlib.get_annotations(
+                func, format=annotationlib.Format.STRING
+            )
+        else:
+            annotations = func.__annotations__
+        return annotations.get("return")
+    except Exception:
+        return None
+
+
+def _annotation_name(annotation):
+    if isinstance(annotation, str):
+        match = _ANNOTATION_NAME.match(annotation)
+        if match is None:
+            return None
+        return match.group(1).rpartition(".")[2]
+    # typing.AsyncIterator[int].__origin__ is collections.abc.AsyncIterator,
+    # and so on
+    try:
+        origin = getattr(annotation, "__origin__", None) or annotation
+        name = getattr(origin, "__name__", None)
+    except Exception:
+        return None
+    return name if isinstance(name, str) else None
+
+
+# function -> frozenset of options implied by its return annotation
+_annotation_cache = register_cache(
+    "annotations", WeakIdentityCache(maxsize=50000), purge=True
+)
+
+
+def _annotation_options(obj):
+    # Only plain functions; anything that forwards to one (methods,
+    # classmethods, partials, ...) gets it from the next link in the chain.
+    # The same goes for functools.wraps wrappers, whose annotations are
+    # copied from the function they wrap, even when that one's code object
+    # says something else.
+    if not isinstance(obj, types.FunctionType) or hasattr(obj, "__wrapped__"):
+        return frozenset()
+    options = _annotation_cache.get(obj)
+    if options is None:
+        option = ANNOTATION_OPTIONS.get(
+            _annotation_name(_raw_return_annotation(obj))
+        )
+        options = frozenset([option] if option else [])
+        _annotation_cache.store(obj, options)
+    return options
+
+
+def set_annotation_sniffing(enabled):
+    """Turn annotation sniffing on or off, forgetting any stale results."""
+    global annotation_sniffing
+    enabled = bool(enabled)
+    if enabled != annotation_sniffing:
+        annotation_sniffing = enabled
+        _sniff_cache.clear()
+        _namespace_cache.clear()
+
+
+def _classify(obj):
+    """Return the options that apply to this one link of a wrapper chain."""
+    options = set()
+    if getattr(obj, "__isabstractmethod__", False):
+        options.add("abstractmethod")
+    if isinstance(obj, _CLASSMETHOD_TYPES):
+        options.add("classmethod")
+    if isinstance(obj, staticmethod):
+        options.add("staticmethod")
+    # if isinstance(obj, property):
+    #     options.add("property")
+
+    flags = 0
+    # These markers (like the context manager ones below) are looked up the
+    # usual way, so compiled callables can also carry them on their type.
+    if (getattr(obj, "_is_coroutine_marker", None) is _COROUTINE_MARK
+            or _is_asyncio_coroutine_marker(getattr(obj, "_is_coroutine", None))):
+        flags = CO_COROUTINE
+    code = getattr(obj, "__code__", None)
+    if isinstance(code, CodeType):
+        flags |= code.co_flags
+        # Some heuristics to detect when something is a context manager
+        cm_codes, acm_codes = _codes or _context_manager_codes()
+        if code in cm_codes:
+            options.add("with")
+        if code in acm_codes:
+            options.add("async-with")
+    options.update(_FLAG_OPTIONS[flags & _FLAGS_MASK])
+    # The async_generator library marks its wrappers like this (this is what
+    # async_generator.isasyncgenfunction checks for)
+    if getattr(obj, "_async_gen_function", -1) == id(obj):
+        options.add("async-for")
+    if getattr(obj, "__returns_contextmanager__", False):
+        options.add("with")
+    if getattr(obj, "__returns_acontextmanager__", False):
+        options.add("async-with")
+    if annotation_sniffing and not options & EXCLUSIVE_OPTIONS:
+        options.update(_annotation_options(obj))
+    return options
+
+
+# Wrappers that keep the wrapped callable in a .func attribute. (The
+# inspect.is*function helpers look through partial objects, so we do too.)
+_FUNC_WRAPPERS = (functools.partial, functools.partialmethod)  # type: tuple
+if hasattr(functools, "singledispatchmethod"):
+    _FUNC_WRAPPERS += (functools.singledispatchmethod,)
+
+# How many links we're willing to follow before deciding that something has
+# gone wrong (e.g. autodoc mock objects have an infinite __wrapped__ chain).
+# Set from the trio_max_wrapper_depth config value.
+max_wrapper_depth = 100
+
+
+def _next_link(obj):
+    try:
+        # functools.wraps, singledispatch, and lots of third-party decorators
+        return obj.__wrapped__
+    except AttributeError:
+        pass
+    try:
+        # staticmethod, classmethod, bound methods
+        return obj.__func__
+    except AttributeError:
+        pass
+    if isinstance(obj, _FUNC_WRAPPERS):
+        return obj.func
+    return None
+
+
+def _describe(obj):
+    name = getattr(obj, "__qualname__", None)
+    module = getattr(obj, "__module__", None)
+    if isinstance(name, str):
+        if isinstance(module, str):
+            return "{}.{}".format(module, name)
+        return name
+    return repr(obj)
+
+
+def _iter_chain(obj, warn=True):
+    # Yields the links of obj's wrapper chain, outermost first, stopping if
+    # the chain loops back on itself or gets suspiciously long.
+    top = obj
+    # id -> obj, holding references so that ids can't be reused while we walk
+    seen = {}
+    while obj is not None:
+        if id(obj) in seen:
+            if warn:
+                logger.warning(
+                    "sphinxcontrib_trio: the __wrapped__ chain of %s contains "
+                    "a cycle; ignoring everything after %s",
+                    _describe(top), _describe(obj),
+                    type="trio", subtype="wrapper_chain",
+                )
+            return
+        if len(seen) >= max_wrapper_depth:
+            if warn:
+                logger.warning(
+                    "sphinxcontrib_trio: the __wrapped__ chain of %s is more "
+                    "than %d links long; ignoring the rest (see "
+                    "trio_max_wrapper_depth)",
+                    _describe(top), max_wrapper_depth,
+                    type="trio", subtype="wrapper_chain",
+                )
+            return
+        seen[id(obj)] = obj
+        yield obj
+        obj = _next_link(obj)
+
+
+def resolve_wrapper_chain(obj):
+    """Return the links in obj's wrapper chain, outermost first.
+
+    This follows ``__wrapped__`` (as set by functools.wraps), ``__func__`` (on
+    classmethod, staticmethod and bound method objects), and ``.func`` (on
+    functools.partial, partialmethod and singledispatchmethod objects). If the
+    chain contains a cycle or is longer than ``max_wrapper_depth``, we log a
+    warning and stop early.
+
+    """
+    return list(_iter_chain(obj))
+
+
+def chain_depth(obj):
+    """Count the links in obj's wrapper chain (for profiling)."""
+    depth = 0
+    for _ in _iter_chain(obj, warn=False):
+        depth += 1
+    return depth
+
+
+# obj -> frozenset of the options sniffed for the chain starting at obj
+_sniff_cache = register_cache(
+    "sniff_options", WeakIdentityCache(maxsize=50000), purge=True
+)
+
+
+def _sniff(obj):
+    result = _sniff_cache.lookup(obj)
+    if result is not None:
+        return result
+    # We walk the __wrapped__ chain until we reach its end, or a link that
+    # we've already sniffed (e.g. because several aliases or re-exports wrap
+    # the same function)...
+    chain = []
+    tail = frozenset()
+    for link in _iter_chain(obj):
+        # (we already know the first link isn't cached)
+        if chain:
+            cached = _sniff_cache.get(link)
+            if cached is not None:
+                tail = cached
+                break
+        chain.append(link)
+    # ...and then fold the per-link options back up from the inside out,
+    # caching the result for each link on the way. Only the outermost link
+    # that has any of the EXCLUSIVE_OPTIONS gets to keep them.
+    for link in reversed(chain):
+        options = _classify(link)
+        if options & EXCLUSIVE_OPTIONS:
+            options.update(tail - EXCLUSIVE_OPTIONS)
+        else:
+            options.update(tail)
+        tail = frozenset(options)
+        _sniff_cache.store(link, tail)
+    return tail
+
+
+def sniff_options(obj):
+    return set(_sniff(obj))
+
+
+# Mirror the functools.lru_cache interface
+sniff_options.cache_info = _sniff_cache.info  # type: ignore
+sniff_options.cache_clear = _sniff_cache.clear  # type: ignore
+
+
+# We only prescan things that are definitely functions. Arbitrary callables
+# might be e.g. autodoc's mock objects, which claim to have every attribute
+# (including an endless __wrapped__ chain); if someone documents one of those
+# explicitly, they'll still get sniffed individually.
+_SNIFFABLE_TYPES = (
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    classmethod,
+    staticmethod,
+    functools.partial,
+)
+
+
+# Like inspect.getattr_static, we look at the raw class dicts and MROs, so
+# that nothing user-defined (properties, __getattr__, metaclass tricks) runs.
+_get_class_dict = type.__dict__["__dict__"].__get__  # type: ignore
+_get_mro = type.__dict__["__mro__"].__get__  # type: ignore
+
+
+def _shadows_dict(klass):
+    # Whether instances of klass have a __dict__ that isn't the real one
+    # (inspect._shadowed_dict); getattr_static ignores classes whose
+    # metaclass does this.
+    for entry in _get_mro(klass):
+        class_dict = _get_class_dict(entry)
+        if "__dict__" in class_dict:
+            descriptor = class_dict["__dict__"]
+            if not (type(descriptor) is types.GetSetDescriptorType
+                    and descriptor.__name__ == "__dict__"
+                    and descriptor.__objclass__ is entry):
+                return True
+    return False
+
+
+def _own_attributes(klass):
+    if _shadows_dict(type(klass)):
+        return {}
+    return _get_class_dict(klass)
+
+
+# class -> {name: where in the class's MRO that attribute comes from}. Just
+# the positions, since the attributes themselves often refer back to the
+# class (e.g. its __dict__ descriptor, or methods that use super()), and we
+# mustn't keep it alive.
+_class_index = register_cache(
+    "class_attributes", WeakIdentityCache(maxsize=10000), purge=True
+)
+
+
+def _attribute_positions(cls):
+    index = _class_index.get(cls)
+    if index is None:
+        mro = _get_mro(cls)
+        if len(mro) > 1 and mro[1:] == _get_mro(mro[1]):
+            # The usual case: the rest of our MRO is just our first base's
+            # MRO, so we can start from its index.
+            index = {
+                name: position + 1
+                for name, position in _attribute_positions(mro[1]).items()
+            }
+            index.update(dict.fromkeys(_own_attributes(cls), 0))
+        else:
+            index = {}
+            for position in reversed(range(len(mro))):
+                own = _own_attributes(mro[position])
+                index.update(dict.fromkeys(own, position))
+        _class_index.store(cls, index)
+    return index
+
+
+def _class_attribute(cls, name):
+    # Raises KeyError if there's no such attribute
+    position = _attribute_positions(cls)[name]
+    return _get_class_dict(_get_mro(cls)[position])[name]
+
+
+def class_attributes(cls):
+    """All the attributes that a class gets from its MRO, as a dict.
+
+    For each name, this has what inspect.getattr_static(cls, name) would find
+    in the class or its bases. (It doesn't include the metaclass's
+    attributes; see getattr_static.) Where each attribute comes from is
+    cached per class, so this is cheap to call again.
+    """
+    mro = _get_mro(cls)
+    return {
+        name: _get_class_dict(mro[position])[name]
+        for name, position in _attribute_positions(cls).items()
+    }
+
+
+def getattr_static(cls, name):
+    """inspect.getattr_static for classes, using class_attributes.
+
+    Raises AttributeError if there's no such attribute.
+    """
+    try:
+        return _class_attribute(cls, name)
+    except KeyError:
+        pass
+    # Like getattr_static, fall back on the metaclass
+    try:
+        return _class_attribute(type(cls), name)
+    except KeyError:
+        raise AttributeError(name) from None
+
+
+def _namespace_members(namespace):
+    if isinstance(namespace, type):
+        # We want the raw classmethod and staticmethod objects, including for
+        # inherited members
+        return class_attributes(namespace)
+    try:
+        return vars(namespace)
+    except TypeError:
+        # No __dict__, e.g. an instance of a class with __slots__; callers
+        # fall back on sniffing each member on its own
+        return {}
+
+
+def namespace_member(namespace, name):
+    """The member of namespace that sniff_table sniffed as name, or None."""
+    if isinstance(namespace, type):
+        try:
+            return _class_attribute(namespace, name)
+        except KeyError:
+            return None
+    return _namespace_members(namespace).get(name)
+
+
+# namespace -> {name: frozenset of options}. Like _class_index, this doesn't
+# hold on to the members, which could keep the namespace alive.
+_namespace_cache = register_cache(
+    "sniff_table", WeakIdentityCache(maxsize=2000), purge=True
+)
+
+
+def sniff_table(namespace):
+    """Like sniff_many, but cached, and shared by all callers.
+
+    The table maps each name to the options of namespace_member(namespace,
+    name), so callers should check that that's still the object they
+    expect. Don't modify it.
+    """
+    table = _namespace_cache.lookup(namespace)
+    if table is None:
+        table = {
+            name: _sniff(member)
+            for name, member in _namespace_members(namespace).items()
+            if isinstance(member, _SNIFFABLE_TYPES)
+        }
+        _namespace_cache.store(namespace, table)
+    return table
+
+
+def sniff_many(namespace):
+    """Sniff every callable in a module or class, in one pass.
+
+    Returns a dict mapping member names to frozensets of options. For classes,
+    this includes inherited members, and classmethods and staticmethods are
+    seen as such (like with inspect.getattr_static).
+
+    """
+    return dict(sniff_table(namespace))
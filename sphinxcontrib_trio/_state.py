@@ -0,0 +1,46 @@
+"""Per-build state that shouldn't end up in the pickled environment.
+
+Autodoc documenters only get to see the build environment, and
+``BuildEnvironment.app`` is deprecated, so we hang our own runtime state off
+the environment object via a weak mapping instead. (Anything that needs to
+survive into the pickled environment, or be merged back from parallel
+readers, belongs in an ``env`` attribute instead.)
+"""
+
+import weakref
+
+_states = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+class BuildState:
+    def __init__(self):
+        # A PersistentSniffCache, if enabled
+        self.sniff_cache = None
+        # fullname -> options sniffed by autodoc, waiting for the directive
+        # that autodoc generates to pick them up. Emptied after every
+        # document, in case anything is never picked up.
+        self.pending_sniffed = {}
+        # fullname -> the object autodoc documented, likewise, for the
+        # trio-options-resolved event
+        self.pending_objects = {}
+        # fullname -> record, built on demand by get_trio_options
+        self.trio_object_index = None
+        # [(base uri, {fullname: (objtype, options)})] from the other
+        # projects' trio inventories, once they've been loaded
+        self.foreign_trio_objects = None
+        # A SniffPool, if enabled and started
+        self.sniff_pool = None
+        # An OptionOverrides, if any are configured
+        self.option_overrides = None
+        # (docname, {id(obj): [obj, fullname, sniffed]}) for the methods
+        # autodoc has documented so far in the document being read, so that
+        # inherited copies of them can reuse the work (see _autodoc.py)
+        self.documented_members = (None, {})
+
+
+def build_state(env):
+    try:
+        return _states[env]
+    except KeyError:
+        state = _states[env] = BuildState()
+        return state
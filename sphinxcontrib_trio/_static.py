@@ -0,0 +1,196 @@
+"""Sniffing options from source code, without importing anything.
+
+This derives the same options as sniff_options, but by parsing the module's
+source with the ast module. It can only see what's spelled out in the
+source, so it knows about ``async def``, ``yield``, and the standard
+decorators, but not e.g. about attributes like ``__returns_contextmanager__``
+that get attached at runtime.
+"""
+
+import os
+import ast
+import sys
+from importlib.machinery import PathFinder, EXTENSION_SUFFIXES
+
+from . import _sniff
+from ._cache import LRUCache, register_cache
+
+# Decorator name -> what it does to the options of the function it wraps.
+# We go by the last component of the decorator's name, so that
+# "contextlib.contextmanager" and "contextmanager" are treated the same.
+_EXCLUSIVE_DECORATORS = {
+    "contextmanager": "with",
+    "asynccontextmanager": "async-with",
+    "async_generator": "async-for",
+}
+_OTHER_DECORATORS = {
+    "classmethod": {"classmethod"},
+    "staticmethod": {"staticmethod"},
+    "abstractmethod": {"abstractmethod"},
+    "abstractclassmethod": {"abstractmethod", "classmethod"},
+    "abstractstaticmethod": {"abstractmethod", "staticmethod"},
+}
+
+_FUNCTION_DEFS = (ast.FunctionDef, ast.AsyncFunctionDef)
+# Things whose bodies have their own scope, so a yield inside them doesn't
+# make the enclosing function a generator.
+_SCOPES = _FUNCTION_DEFS + (ast.ClassDef, ast.Lambda)
+
+
+def _contains_yield(node):
+    todo = list(ast.iter_child_nodes(node))
+    while todo:
+        child = todo.pop()
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return True
+        if not isinstance(child, _SCOPES):
+            todo.extend(ast.iter_child_nodes(child))
+    return False
+
+
+def _decorator_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    # Decorator factories like @foo(...), and anything more exotic
+    return None
+
+
+# String literals are ast.Str (with the text in .s) before Python 3.8
+if sys.version_info >= (3, 8):
+    _STRING_NODE, _STRING_FIELD = ast.Constant, "value"
+else:  # pragma: no cover
+    _STRING_NODE, _STRING_FIELD = ast.Str, "s"
+
+
+def _annotation_name(node):
+    # -> AsyncIterator[int], -> typing.AsyncIterator, -> "AsyncIterator[T]"
+    if isinstance(node, ast.Subscript):
+        node = node.value
+    if isinstance(node, _STRING_NODE):
+        text = getattr(node, _STRING_FIELD)
+        if isinstance(text, str):
+            return _sniff._annotation_name(text)
+    return _decorator_name(node)
+
+
+def _options_for_def(node, annotations):
+    exclusive = set()
+    if isinstance(node, ast.AsyncFunctionDef):
+        exclusive.add("async-for" if _contains_yield(node) else "async")
+    elif _contains_yield(node):
+        exclusive.add("for")
+    elif annotations and node.returns is not None:
+        option = _sniff.ANNOTATION_OPTIONS.get(_annotation_name(node.returns))
+        if option:
+            exclusive.add(option)
+    options = set()
+    # decorator_list is outermost-first, and just like when walking the
+    # __wrapped__ chain at runtime, the outermost exclusive option wins.
+    for decorator in reversed(node.decorator_list):
+        name = _decorator_name(decorator)
+        if name in _EXCLUSIVE_DECORATORS:
+            exclusive = {_EXCLUSIVE_DECORATORS[name]}
+        options.update(_OTHER_DECORATORS.get(name, ()))
+    return frozenset(options | exclusive)
+
+
+def _walk_defs(body, prefix, table, annotations):
+    for node in body:
+        if isinstance(node, _FUNCTION_DEFS):
+            table[prefix + node.name] = _options_for_def(node, annotations)
+        elif isinstance(node, ast.ClassDef):
+            _walk_defs(node.body, prefix + node.name + ".", table, annotations)
+        # Conditional definitions, like "if sys.version_info >= ...:" or
+        # "try: ... except ImportError: ...". Later definitions win, just like
+        # they would at runtime (at least when all branches run...)
+        elif isinstance(node, ast.If):
+            _walk_defs(node.body, prefix, table, annotations)
+            _walk_defs(node.orelse, prefix, table, annotations)
+        elif isinstance(node, ast.Try):
+            for block in [node.body, *(h.body for h in node.handlers),
+                          node.orelse, node.finalbody]:
+                _walk_defs(block, prefix, table, annotations)
+
+
+def _source_for(filename):
+    if filename.endswith(".py"):
+        return filename
+    # Modules compiled with Cython or mypyc often still have their .py
+    # source right next to them (e.g. after an in-place build)
+    for suffix in EXTENSION_SUFFIXES:
+        if filename.endswith(suffix):
+            source = filename[:-len(suffix)] + ".py"
+            if os.path.exists(source):
+                return source
+            break
+    return None
+
+
+def module_source_path(modname):
+    """Find the source file for a module without importing it.
+
+    importlib.util.find_spec would import the module's parent packages, so we
+    walk the package path ourselves instead. For compiled modules, this is
+    the .py file next to the extension module, if there is one.
+    """
+    module = sys.modules.get(modname)
+    if module is not None:
+        filename = getattr(module, "__file__", None)
+        if filename:
+            return _source_for(filename)
+    path = None
+    spec = None
+    parts = modname.split(".")
+    for i in range(len(parts)):
+        spec = PathFinder.find_spec(".".join(parts[:i + 1]), path)
+        if spec is None:
+            return None
+        path = spec.submodule_search_locations
+    if spec.origin:
+        return _source_for(spec.origin)
+    return None
+
+
+# filename -> ((mtime_ns, size, annotation_sniffing),
+#              {qualname: frozenset of options})
+_tables = register_cache("static_tables", LRUCache(maxsize=500))
+
+
+def _module_table(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    annotations = _sniff.annotation_sniffing
+    stamp = (st.st_mtime_ns, st.st_size, annotations)
+    cached = _tables.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(filename, "rb") as f:
+            tree = ast.parse(f.read(), filename)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    table = {}
+    _walk_defs(tree.body, "", table, annotations)
+    _tables.store(filename, (stamp, table))
+    return table
+
+
+def sniff_options_static(modname, qualname):
+    """Sniff the options for ``modname.qualname`` from source.
+
+    Returns a set of options, or None if the definition couldn't be found
+    (e.g. because it's inherited, generated at runtime, or defined in an
+    extension module), in which case you'll have to fall back on
+    sniff_options.
+    """
+    filename = module_source_path(modname)
+    if filename is None:
+        return None
+    table = _module_table(filename)
+    if table is None or qualname not in table:
+        return None
+    return set(table[qualname])
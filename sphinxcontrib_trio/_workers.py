@@ -0,0 +1,215 @@
+"""Sniffing in a pool of separate worker processes.
+
+With ``trio_sniff_workers`` set, the autodoc documenters ask a pool of
+worker processes for each module's options, instead of sniffing the objects
+that autodoc imported. The workers import the module,
+sniff everything in it, and send back only a table of qualified names to
+options, so whatever the module drags in stays out of the sphinx-build
+process. That's most useful together with ``autodoc_mock_imports``: the
+build process only ever sees cheap mocks, and the workers sniff the real
+thing.
+
+Workers are replaced after ``trio_sniff_worker_max_imports`` modules, so
+that they don't grow without bound either. If a worker takes longer than
+``trio_sniff_worker_timeout`` seconds to answer (say, an import that hangs),
+we stop the whole pool and go back to sniffing in the build process.
+
+The workers are fresh interpreters running ``python -m
+sphinxcontrib_trio._workers``, talking pickles over their stdin and stdout.
+(multiprocessing's spawn mode would re-run the build's ``__main__``
+script in each worker, which isn't something we want to do to people's
+build scripts.) They exit when their stdin is closed, including when the
+process that started them goes away.
+"""
+
+import os
+import sys
+import queue
+import pickle
+import threading
+import inspect
+import importlib
+import subprocess
+
+from sphinx.util import logging
+
+from ._sniff import sniff_table
+from ._state import build_state
+
+logger = logging.getLogger(__name__)
+
+
+def _walk(modname, namespace, prefix, table, seen):
+    seen.add(id(namespace))
+    for name, options in sniff_table(namespace).items():
+        table[prefix + name] = sorted(options)
+    for name, member in list(vars(namespace).items()):
+        # Classes defined in this module, including nested ones
+        if (inspect.isclass(member) and id(member) not in seen
+                and member.__module__ == modname):
+            _walk(modname, member, prefix + name + ".", table, seen)
+
+
+def sniff_module(modname):
+    """Runs in a worker: {qualname: sorted options} for a whole module.
+
+    Returns None if the module can't be imported.
+    """
+    try:
+        module = importlib.import_module(modname)
+    except Exception:
+        return None
+    table = {}
+    _walk(modname, module, "", table, set())
+    return table
+
+
+class _Worker:
+    def __init__(self):
+        env = dict(os.environ)
+        # So the worker can import whatever conf.py made importable
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", __name__],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+        )
+        self.imports = 0
+        # Blocking reads from a pipe can't time out, so a thread does them
+        # and hands over each answer (or what went wrong) through here
+        self._answers = queue.Queue()
+        threading.Thread(target=self._read_answers, daemon=True).start()
+
+    def _read_answers(self):
+        try:
+            while True:
+                self._answers.put(pickle.load(self.process.stdout))
+        except Exception as exc:
+            self._answers.put(exc)
+
+    def sniff_module(self, modname, timeout):
+        # Raises queue.Empty if there's no answer within timeout seconds
+        self.imports += 1
+        pickle.dump(modname, self.process.stdin, pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+        answer = self._answers.get(timeout=timeout)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class SniffPool:
+    def __init__(self, processes, max_imports, timeout=None):
+        self.pid = os.getpid()
+        self.processes = processes
+        self.max_imports = max_imports
+        self.timeout = timeout
+        # Set once a worker has timed out; we don't start any more
+        self.stopped = False
+        self._workers = []
+        self._next = 0
+        # modname -> table, or None if the worker couldn't import it
+        self._tables = {}
+
+    def _worker(self):
+        # Hand out the workers round-robin, starting them as needed
+        if len(self._workers) < self.processes:
+            self._workers.append(_Worker())
+            return self._workers[-1]
+        self._next = (self._next + 1) % len(self._workers)
+        worker = self._workers[self._next]
+        if self.max_imports and worker.imports >= self.max_imports:
+            worker.close()
+            worker = self._workers[self._next] = _Worker()
+        return worker
+
+    def _sniff_module(self, modname):
+        worker = self._worker()
+        try:
+            return worker.sniff_module(modname, self.timeout)
+        except queue.Empty:
+            logger.warning(
+                "sniffing worker took more than %s seconds to import %s; "
+                "sniffing in this process from now on "
+                "(see trio_sniff_worker_timeout)", self.timeout, modname,
+                type="trio", subtype="sniff_workers",
+            )
+            self.stopped = True
+            for worker in self._workers:
+                worker.kill()
+            self._workers = []
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as exc:
+            logger.warning(
+                "sniffing worker died while importing %s: %r", modname, exc,
+                type="trio", subtype="sniff_workers",
+            )
+            self._workers.remove(worker)
+            worker.kill()
+            return None
+
+    def lookup(self, modname, qualname):
+        """The options for modname.qualname, or None if we don't know them."""
+        try:
+            table = self._tables[modname]
+        except KeyError:
+            if self.stopped:
+                return None
+            table = self._tables[modname] = self._sniff_module(modname)
+            if table is None:
+                logger.debug(
+                    "[sphinxcontrib_trio] worker couldn't import %s", modname
+                )
+        if table is None or qualname not in table:
+            return None
+        return frozenset(table[qualname])
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+
+def sniff_pool(env):
+    """The SniffPool for this build and process, or None if disabled."""
+    processes = env.config.trio_sniff_workers
+    if not processes:
+        return None
+    state = build_state(env)
+    pool = state.sniff_pool
+    # Parallel readers are forked from the main process, and can't share its
+    # workers' pipes, so each of them starts its own. (Those exit along with
+    # the reader.)
+    if pool is None or pool.pid != os.getpid():
+        pool = state.sniff_pool = SniffPool(
+            processes, env.config.trio_sniff_worker_max_imports,
+            env.config.trio_sniff_worker_timeout,
+        )
+    return pool
+
+
+def _serve():
+    # Keep the real stdout for talking to the parent, and send anything that
+    # the modules we import print to stderr instead
+    channel = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    requests = sys.stdin.buffer
+    while True:
+        try:
+            modname = pickle.load(requests)
+        except EOFError:
+            return
+        pickle.dump(sniff_module(modname), channel, pickle.HIGHEST_PROTOCOL)
+        channel.flush()
+
+
+if __name__ == "__main__":
+    _serve()
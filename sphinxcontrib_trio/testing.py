@@ -0,0 +1,191 @@
+"""Helpers for testing docs that use sphinxcontrib-trio.
+
+Shelling out to ``sphinx-build`` and picking through the HTML it writes is
+slow, so this module builds docs in the current process instead, and lets
+you look at the rendered signatures in the doctree directly::
+
+   from sphinxcontrib_trio.testing import build_docs, signature_prefixes
+
+   build = build_docs("docs/source", tmp_path / "out")
+   assert ("trio.open_file", "await ") in signature_prefixes(
+       build.doctree("reference-io")
+   )
+
+If you use pytest, add ``pytest_plugins = ["sphinxcontrib_trio.testing"]``
+to a test module or your top-level ``conftest.py`` to get two fixtures:
+
+``trio_build``
+   A function that builds a docs tree into a fresh temporary directory,
+   taking the same arguments as `build_docs` (minus ``outdir``).
+
+``trio_shared_build``
+   The same, but session-scoped, and each combination of source
+   directory, builder and config overrides is only built once per test
+   session. The source directory is copied first, so that extensions that
+   write into it (e.g. autosummary) can't leave anything behind.
+
+Importing this module doesn't import pytest, unless it's already installed.
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import itertools
+from collections import namedtuple
+
+from sphinx import addnodes
+
+try:
+    import pytest
+except ImportError:  # pragma: no cover
+    pytest = None  # type: ignore
+
+from ._compat import findall
+
+__all__ = [
+    "TrioBuild", "Signature", "build_docs", "signatures",
+    "signature_prefixes",
+]
+
+
+class TrioBuild:
+    """The result of build_docs: the Sphinx app, plus what it printed."""
+
+    def __init__(self, app, status, warnings, duration):
+        self.app = app
+        # What Sphinx printed to stdout and stderr, respectively
+        self.status = status
+        self.warnings = warnings
+        # How long app.build() took, in seconds
+        self.duration = duration
+
+    @property
+    def env(self):
+        return self.app.env
+
+    @property
+    def outdir(self):
+        return str(self.app.outdir)
+
+    def doctree(self, docname):
+        """The doctree for docname, as it was read (before resolving)."""
+        return self.env.get_doctree(docname)
+
+    def signatures(self, docname):
+        return signatures(self.doctree(docname))
+
+    def signature_prefixes(self, docname):
+        return signature_prefixes(self.doctree(docname))
+
+
+def build_docs(srcdir, outdir, *, doctreedir=None, buildername="html",
+               confoverrides=None, freshenv=False, parallel=0):
+    """Build the docs in srcdir into outdir, without starting a new process.
+
+    Returns a TrioBuild. Any changes that ``conf.py`` makes to ``sys.path``
+    are undone once the build is finished.
+    """
+    from sphinx.application import Sphinx
+
+    if doctreedir is None:
+        doctreedir = os.path.join(str(outdir), ".doctrees")
+    status = io.StringIO()
+    warnings = io.StringIO()
+    saved_path = sys.path[:]
+    try:
+        app = Sphinx(
+            str(srcdir), str(srcdir), str(outdir), str(doctreedir),
+            buildername, confoverrides=dict(confoverrides or {}),
+            status=status, warning=warnings, freshenv=freshenv,
+            parallel=parallel,
+        )
+        start = time.perf_counter()
+        app.build()
+        duration = time.perf_counter() - start
+    finally:
+        sys.path[:] = saved_path
+    return TrioBuild(app, status.getvalue(), warnings.getvalue(), duration)
+
+
+# fullname: the object's fully qualified name
+# prefix: the rendered prefix, e.g. "async with ", or "" if there isn't one
+# suffix: the rendered " as ..." suffix (starting with U+00A0), or ""
+# node: the desc_signature node itself
+Signature = namedtuple("Signature", ["fullname", "prefix", "suffix", "node"])
+
+
+# The directives we extend
+_OBJTYPES = {
+    "function", "method", "classmethod", "staticmethod", "decorator",
+    "decoratormethod",
+}
+
+
+def _annotation_text(node):
+    if isinstance(node, addnodes.desc_annotation):
+        return node.astext()
+    return ""
+
+
+def signatures(doctree):
+    """The function and method signatures in doctree, as Signatures.
+
+    They're listed in document order, and objects that are documented more
+    than once (e.g. with ``:noindex:``) show up once for each time.
+    """
+    found = []
+    for signode in findall(doctree, addnodes.desc_signature):
+        desc = signode.parent
+        if desc.get("domain") != "py" or desc.get("objtype") not in _OBJTYPES:
+            continue
+        fullname = signode.get("fullname", "")
+        if signode.get("module"):
+            fullname = signode["module"] + "." + fullname
+        # Our prefix is always the first child, and our suffix the last (see
+        # ExtendedCallableMixin.handle_signature)
+        prefix = _annotation_text(signode[0]) if len(signode) else ""
+        suffix = _annotation_text(signode[-1]) if len(signode) else ""
+        if not suffix.startswith("\u00A0as"):
+            suffix = ""
+        found.append(Signature(fullname, prefix, suffix, signode))
+    return found
+
+
+def signature_prefixes(doctree):
+    """[(fullname, prefix)] for the Python signatures in doctree, in order."""
+    return [(sig.fullname, sig.prefix) for sig in signatures(doctree)]
+
+
+if pytest is not None:
+
+    @pytest.fixture
+    def trio_build(tmp_path):
+        counter = itertools.count()
+
+        def build(srcdir, **kwargs):
+            outdir = tmp_path / "trio-build-{}".format(next(counter))
+            return build_docs(srcdir, outdir, **kwargs)
+
+        return build
+
+    @pytest.fixture(scope="session")
+    def trio_shared_build(tmp_path_factory):
+        builds = {}
+
+        def build(srcdir, *, buildername="html", confoverrides=None):
+            key = (
+                os.path.abspath(str(srcdir)), buildername,
+                repr(sorted((confoverrides or {}).items())),
+            )
+            if key not in builds:
+                root = tmp_path_factory.mktemp("trio-build")
+                shutil.copytree(str(srcdir), str(root / "src"))
+                builds[key] = build_docs(
+                    root / "src", root / "out", buildername=buildername,
+                    confoverrides=confoverrides,
+                )
+            return builds[key]
+
+        return build
@@ -0,0 +1 @@
+pytest_plugins = ["sphinxcontrib_trio.testing"]
@@ -1,16 +1,23 @@
+import gc
+import os
 import re
+import json
+import pickle
 import abc
 import sys
 import shutil
 import inspect
 import textwrap
+import weakref
 import subprocess
 from pathlib import Path
-from functools import wraps
+from functools import wraps, partial, partialmethod
 from typing import Callable, cast
 from contextlib import contextmanager
 
+import pytest
 import lxml.html
+from sphinx import addnodes
 
 try:
     from contextlib2 import contextmanager as contextmanager2
@@ -33,7 +40,14 @@ except ImportError:
 else:
     have_asynccontextmanager = True
 
-from sphinxcontrib_trio import sniff_options
+from sphinxcontrib_trio import sniff_options, sniff_options_static, sniff_many
+from sphinxcontrib_trio import _persist, _profile, _sniff
+from sphinxcontrib_trio._state import build_state
+from sphinxcontrib_trio._compat import findall
+from sphinxcontrib_trio import resolve_wrapper_chain
+from sphinxcontrib_trio.testing import build_docs, signatures, signature_prefixes
+
+TEST_DOCS_SOURCE = Path(__file__).parent / "test-docs-source"
 
 if sys.version_info >= (3, 6):
     agen_native = cast(Callable, lambda: None)  # satisfy linter
@@ -175,21 +189,523 @@ def test_sniff_options():
     check(messy3, "with", "staticmethod")
 
 
-# Hopefully the next sphinx release will have dedicated pytest-based testing
-# utilities:
-#
-#   https://github.com/sphinx-doc/sphinx/issues/3458
-#   https://github.com/sphinx-doc/sphinx/pull/3718
-#
-# Until then...
-def test_end_to_end(tmpdir):
-    shutil.copytree(str(Path(__file__).parent / "test-docs-source"),
-                    str(tmpdir / "test-docs-source"))
-    subprocess.run(
-        ["sphinx-build", "-v", "-nW", "-nb", "html",
-         str(tmpdir / "test-docs-source"), str(tmpdir / "out")])
+def test_wrapper_chains(monkeypatch):
+    warnings = []
+
+    class FakeLogger:
+        def warning(self, msg, *args, **kwargs):
+            warnings.append(msg % args)
+
+    monkeypatch.setattr(_sniff, "logger", FakeLogger())
+
+    async def async_fn(a, b):  # pragma: no cover
+        pass
+
+    def gen(a, b):  # pragma: no cover
+        yield
+
+    p = partial(async_fn, 1)
+    assert resolve_wrapper_chain(p) == [p, async_fn]
+    check_partial = partial(partial(gen, 1), 2)
+    assert sniff_options(check_partial) == {"for"}
+
+    class Methods:  # pragma: no cover
+        amethod = partialmethod(async_fn, 1)
+
+    assert sniff_options(inspect.getattr_static(Methods, "amethod")) == {"async"}
+
+    # A buggy decorator that points __wrapped__ at itself
+    def selfish():  # pragma: no cover
+        yield
+    selfish.__wrapped__ = selfish  # type: ignore
+    assert sniff_options(selfish) == {"for"}
+    assert len(warnings) == 1
+    assert "selfish" in warnings[0] and "cycle" in warnings[0]
+
+    # A longer cycle
+    def cyc1():  # pragma: no cover
+        pass
+
+    async def cyc2():  # pragma: no cover
+        pass
+
+    cyc1.__wrapped__ = cyc2  # type: ignore
+    cyc2.__wrapped__ = cyc1  # type: ignore
+    assert sniff_options(cyc1) == {"async"}
+    assert "cyc1" in warnings[-1]
+
+    # An endless chain of fresh objects, like autodoc's mocks produce
+    class Endless:
+        @property
+        def __wrapped__(self):
+            return Endless()
+
+    monkeypatch.setattr(_sniff, "max_wrapper_depth", 10)
+    assert len(resolve_wrapper_chain(Endless())) == 10
+    assert "more than 10 links" in warnings[-1]
+    assert sniff_options(Endless()) == set()
+
+
+def test_sniff_options_cache():
+    sniff_options.cache_clear()
+
+    async def async_fn():  # pragma: no cover
+        pass
+
+    @wraps(async_fn)
+    def alias():  # pragma: no cover
+        pass
+
+    assert sniff_options(async_fn) == {"async"}
+    assert sniff_options.cache_info() == (0, 1, 1)
+    assert sniff_options(async_fn) == {"async"}
+    assert sniff_options.cache_info() == (1, 1, 1)
+    # Callers get their own set to mutate
+    sniff_options(async_fn).add("for")
+    assert sniff_options(async_fn) == {"async"}
+
+    # Walking the wrapper reuses the result for the function it wraps
+    assert sniff_options(alias) == {"async"}
+    assert sniff_options.cache_info().currsize == 2
+
+    # Entries don't keep their objects alive
+    del async_fn, alias
+    gc.collect()
+    assert sniff_options.cache_info().currsize == 0
+
+    # Objects that can't be weakly referenced still work, they just aren't
+    # cached
+    class Basic:
+        @classmethod
+        def method(cls):  # pragma: no cover
+            pass
+
+    assert sniff_options(inspect.getattr_static(Basic, "method")) == {"classmethod"}
+    assert sniff_options.cache_info().currsize == 1
+
+
+def test_sniff_many():
+    class Base:
+        async def a(self):  # pragma: no cover
+            pass
+
+        def b(self):  # pragma: no cover
+            yield
+
+    class Sub(Base):
+        @classmethod
+        def b(cls):  # pragma: no cover
+            pass
+
+        @staticmethod
+        @contextmanager
+        def c():  # pragma: no cover
+            yield
+
+        class Nested:
+            pass
+
+        not_a_function = 1
+
+    table = sniff_many(Sub)
+    assert {k: v for k, v in table.items() if not k.startswith("__")} == {
+        "a": {"async"},
+        "b": {"classmethod"},
+        "c": {"staticmethod", "with"},
+    }
+    for name, options in table.items():
+        assert options == sniff_options(inspect.getattr_static(Sub, name))
+
+    module_table = sniff_many(sys.modules[__name__])
+    assert module_table["test_sniff_many"] == set()
+    assert "agen_native" in module_table
+    assert "Path" not in module_table
+
+
+def test_slotted_parent(tmpdir):
+    class Slotted:
+        __slots__ = ("fetch",)
+
+    async def fetch():  # pragma: no cover
+        pass
+
+    api = Slotted()
+    api.fetch = fetch
+    assert sniff_many(api) == {}
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+    """), "utf-8")
+    (srcdir / "slotmod.py").write_text(textwrap.dedent("""
+        class API:
+            __slots__ = ("fetch",)
+
+        async def _fetch():
+            "Fetch the thing."
+
+        api = API()
+        api.fetch = _fetch
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(
+        ".. autofunction:: slotmod.api.fetch\n", "utf-8"
+    )
+    build = build_docs(srcdir, tmpdir / "out")
+    assert [prefix for _, prefix in build.signature_prefixes("index")] == [
+        "await "
+    ]
+    sys.modules.pop("slotmod", None)
+
+
+def test_class_attributes():
+    class Meta(type):
+        def meta_only(cls):  # pragma: no cover
+            pass
+
+        def shadowed(cls):  # pragma: no cover
+            pass
+
+    class Base(metaclass=Meta):
+        @classmethod
+        def cm(cls):  # pragma: no cover
+            pass
+
+        @staticmethod
+        def sm():  # pragma: no cover
+            pass
+
+        def shadowed(self):  # pragma: no cover
+            pass
+
+        prop = property(lambda self: 1 / 0)
+
+    class Left(Base):
+        @staticmethod
+        def cm():  # pragma: no cover
+            pass
+
+    class Right(Base):
+        async def sm(self):  # pragma: no cover
+            pass
+
+    class Diamond(Left, Right):
+        pass
+
+    class Deep(Diamond):
+        def extra(self):  # pragma: no cover
+            pass
+
+    names = ["cm", "sm", "shadowed", "prop", "meta_only", "extra", "mro",
+             "__init__", "__dict__", "missing"]
+    for cls in [Base, Left, Right, Diamond, Deep]:
+        for name in names:
+            try:
+                expected = inspect.getattr_static(cls, name)
+            except AttributeError:
+                with pytest.raises(AttributeError):
+                    _sniff.getattr_static(cls, name)
+            else:
+                assert _sniff.getattr_static(cls, name) is expected, (cls, name)
+
+    # Single-inheritance subclasses extend their base's index
+    assert "extra" in _sniff.class_attributes(Deep)
+    assert "extra" not in _sniff.class_attributes(Diamond)
+    assert sniff_many(Deep)["cm"] == {"staticmethod"}
+    assert sniff_many(Deep)["sm"] == {"async"}
+    assert "meta_only" not in sniff_many(Deep)
+
+    # Neither cache keeps the class alive, even though its __dict__
+    # descriptor and methods that use super() refer back to it
+    class Collected(Base):
+        @classmethod
+        def cm(cls):  # pragma: no cover
+            return super().cm()
+
+    assert _sniff.getattr_static(Collected, "cm") is Collected.__dict__["cm"]
+    assert sniff_many(Collected)["cm"] == {"classmethod"}
+    def sizes():
+        return len(_sniff._class_index), len(_sniff._namespace_cache)
+
+    before = sizes()
+    collected = weakref.ref(Collected)
+    del Collected
+    gc.collect()
+    assert collected() is None
+    assert sizes() == (before[0] - 1, before[1] - 1)
+
+
+def test_sniff_options_static(tmpdir, monkeypatch):
+    pkg = tmpdir / "static_pkg"
+    pkg.mkdir()
+    # If sniffing imported anything, this would blow up
+    (pkg / "__init__.py").write_text("raise RuntimeError\n", "utf-8")
+    (pkg / "mod.py").write_text(textwrap.dedent("""
+        import abc
+        import contextlib
+        from contextlib import asynccontextmanager
+
+        raise RuntimeError
+
+        def boring():
+            def inner():
+                yield
+            return lambda: (yield)
 
-    tree = lxml.html.parse(str(tmpdir / "out" / "test.html")).getroot()
+        async def async_fn():
+            pass
+
+        def gen():
+            yield from []
+
+        async def agen():
+            yield
+
+        @contextlib.contextmanager
+        def cm():
+            yield
+
+        @asynccontextmanager
+        async def acm():
+            yield
+
+        class Basic(abc.ABC):
+            def a(self):
+                pass
+
+            @classmethod
+            async def classasync(cls):
+                pass
+
+            @staticmethod
+            @abc.abstractmethod
+            def abstatic():
+                yield
+
+        try:
+            from somewhere import fallback
+        except ImportError:
+            async def fallback():
+                pass
+    """), "utf-8")
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    def check(qualname, *expected):
+        __tracebackhide__ = True
+        assert sniff_options_static("static_pkg.mod", qualname) == set(expected)
+
+    check("boring")
+    check("async_fn", "async")
+    check("gen", "for")
+    check("agen", "async-for")
+    check("cm", "with")
+    check("acm", "async-with")
+    check("Basic.a")
+    check("Basic.classasync", "classmethod", "async")
+    check("Basic.abstatic", "staticmethod", "abstractmethod", "for")
+    check("fallback", "async")
+    assert sniff_options_static("static_pkg.mod", "missing") is None
+    assert sniff_options_static("static_pkg.missing", "boring") is None
+    assert "static_pkg" not in sys.modules
+
+
+def test_annotation_sniffing(tmpdir, monkeypatch):
+    import typing
+    from sphinxcontrib_trio import _sniff
+
+    # Wrappers that return the real thing, but don't look like it
+    def opaque_acm() -> typing.AsyncContextManager[int]:
+        pass
+
+    def opaque_agen() -> "typing.AsyncIterator[NotDefinedAnywhere]":
+        pass
+
+    def opaque_async() -> "Awaitable[int]":
+        pass
+
+    def opaque_cm() -> typing.ContextManager:
+        pass
+
+    def iterable() -> typing.Iterable[int]:
+        pass
+
+    async def annotated_async() -> typing.AsyncIterator[int]:
+        pass
+
+    @wraps(opaque_agen)
+    def wrapper(*args, **kwargs):
+        pass
+
+    @wraps(annotated_async)
+    def sync_wrapper(*args, **kwargs):
+        pass
+
+    def check_all(enabled):
+        assert sniff_options(opaque_acm) == ({"async-with"} if enabled else set())
+        assert sniff_options(opaque_agen) == ({"async-for"} if enabled else set())
+        assert sniff_options(opaque_async) == ({"async"} if enabled else set())
+        assert sniff_options(opaque_cm) == ({"with"} if enabled else set())
+        assert sniff_options(wrapper) == ({"async-for"} if enabled else set())
+        assert sniff_options(iterable) == set()
+        # What the code object says wins over the annotation
+        assert sniff_options(annotated_async) == {"async"}
+        # ...even when a wrapper has copied the annotation
+        assert sniff_options(sync_wrapper) == {"async"}
+
+    check_all(False)
+    _sniff.set_annotation_sniffing(True)
+    try:
+        check_all(True)
+    finally:
+        _sniff.set_annotation_sniffing(False)
+    # Turning it off again forgets what we sniffed with it on
+    check_all(False)
+
+    pkg = tmpdir / "annotated_pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("", "utf-8")
+    (pkg / "mod.py").write_text(textwrap.dedent("""
+        import typing
+        from typing import AsyncIterator
+
+        def agen() -> AsyncIterator[int]:
+            pass
+
+        def acm() -> "typing.AsyncContextManager[Missing]":
+            pass
+
+        async def afn() -> AsyncIterator[int]:
+            pass
+    """), "utf-8")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    assert sniff_options_static("annotated_pkg.mod", "agen") == set()
+    _sniff.set_annotation_sniffing(True)
+    try:
+        assert sniff_options_static("annotated_pkg.mod", "agen") == {"async-for"}
+        assert sniff_options_static("annotated_pkg.mod", "acm") == {"async-with"}
+        assert sniff_options_static("annotated_pkg.mod", "afn") == {"async"}
+    finally:
+        _sniff.set_annotation_sniffing(False)
+    assert sniff_options_static("annotated_pkg.mod", "agen") == set()
+
+
+def test_compiled_callables(tmpdir, monkeypatch):
+    import asyncio.coroutines
+    from sphinxcontrib_trio import _sniff
+
+    # Stand-ins for what Cython and friends produce: callables without a
+    # __code__, which say what they are some other way
+    class cython_function_or_method:
+        def __init__(self, is_coroutine):
+            self._is_coroutine = is_coroutine
+
+        def __call__(self):  # pragma: no cover
+            pass
+
+    if hasattr(asyncio.coroutines, "_is_coroutine"):
+        marked = cython_function_or_method(asyncio.coroutines._is_coroutine)
+        assert sniff_options(marked) == {"async"}
+    assert sniff_options(cython_function_or_method(True)) == {"async"}
+    assert sniff_options(cython_function_or_method(None)) == set()
+    assert sniff_options(cython_function_or_method(object())) == set()
+    assert _sniff.is_compiled_callable(cython_function_or_method(None))
+
+    # Markers on the type of a compiled callable
+    class CompiledCM:
+        __returns_acontextmanager__ = True
+
+        def __call__(self):  # pragma: no cover
+            pass
+
+    assert sniff_options(CompiledCM()) == {"async-with"}
+    if hasattr(inspect, "markcoroutinefunction"):
+        class CompiledCoroutine:
+            _is_coroutine_marker = _sniff._COROUTINE_MARK
+
+            def __call__(self):  # pragma: no cover
+                pass
+
+        assert sniff_options(CompiledCoroutine()) == {"async"}
+
+    # Builtin classmethods, like mypyc's
+    assert sniff_options(dict.__dict__["fromkeys"]) == {"classmethod"}
+    assert _sniff.is_compiled_callable(len)
+    assert _sniff.is_compiled_callable(staticmethod(len))
+    assert not _sniff.is_compiled_callable(lambda: None)
+
+    # When a compiled module's source is next to it, autodoc uses that
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("impl"))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+    """), "utf-8")
+    # The "compiled" module: builtins, pretending to live in an extension
+    # module next to their source
+    (srcdir / "impl").mkdir()
+    (srcdir / "impl" / "compiled_examples.py").write_text(textwrap.dedent("""
+        import os
+        from operator import truediv as fetch, floordiv as plain
+
+        __file__ = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), "pkgsrc",
+            "compiled_examples.abi3.so",
+        )
+    """), "utf-8")
+    (srcdir / "pkgsrc").mkdir()
+    (srcdir / "pkgsrc" / "compiled_examples.py").write_text(textwrap.dedent("""
+        async def fetch(a, b):
+            pass
+
+        def plain(a, b):
+            pass
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: compiled_examples.fetch
+
+        .. autofunction:: compiled_examples.plain
+    """), "utf-8")
+    build = build_docs(srcdir, tmpdir / "out")
+    assert build.signature_prefixes("index") == [
+        ("compiled_examples.fetch", "await "),
+        ("compiled_examples.plain", ""),
+    ]
+
+
+def test_with_sniffed_options():
+    from sphinx.ext.autodoc import Options
+    from sphinxcontrib_trio._autodoc import with_sniffed_options
+
+    async def afn():  # pragma: no cover
+        pass
+
+    def fn():  # pragma: no cover
+        pass
+
+    shared = Options({"members": None, "for": "item"})
+    # Nothing to add, so no copy
+    assert with_sniffed_options(fn, shared) is shared
+    assert with_sniffed_options(afn, Options({"async": None})) == {"async": None}
+    # Sniffing adds something, so we get a copy, and the shared options
+    # never change
+    updated = with_sniffed_options(afn, shared)
+    assert updated == {"members": None, "for": "item", "async": None}
+    assert isinstance(updated, Options)
+    assert shared == {"members": None, "for": "item"}
+    # Explicit values aren't overwritten
+    assert with_sniffed_options(
+        afn, Options({"for": "x"}), sniff=lambda obj: {"for"},
+    ) == {"for": "x"}
+    skipped = Options({"no-auto-options": None})
+    assert with_sniffed_options(afn, skipped) is skipped
+
+
+def test_end_to_end(trio_shared_build):
+    build = trio_shared_build(TEST_DOCS_SOURCE)
+    tree = lxml.html.parse(os.path.join(build.outdir, "test.html")).getroot()
 
     def do_html_test(node, *, expect_match):
         original_content = node.text_content()
@@ -241,22 +757,1223 @@ def test_end_to_end(tmpdir):
         do_html_test(note, expect_match=True)
 
 
-def test_member_order(tmpdir):
+def test_member_order(trio_shared_build):
+    build = trio_shared_build(
+        TEST_DOCS_SOURCE, confoverrides={"autodoc_member_order": "bysource"}
+    )
+    names = [
+        sig.fullname for sig in build.signatures("test")
+        if sig.fullname.startswith("autodoc_examples.ExampleClassForOrder.")
+    ]
+
+    assert [name.split(".")[-1] for name in names] == [
+        "d_asyncmethod", "a_syncmethod", "c_asyncmethod", "b_syncmethod",
+    ]
+
+
+def test_testing_helpers(tmpdir, trio_build, trio_shared_build):
+    srcdir = tmpdir / "src"
+    write_multidoc_project(srcdir, ndocs=1)
+    build = trio_build(srcdir)
+    assert build.duration > 0
+    assert build.signature_prefixes("doc0") == [
+        ("pkg0.afn", "await "),
+        ("pkg0.afn", "for item in "),
+        ("pkg0.C.cm", "classmethod with "),
+    ]
+    doctree = build.doctree("doc0")
+    assert signature_prefixes(doctree) == build.signature_prefixes("doc0")
+    cm = signatures(doctree)[-1]
+    assert cm.suffix == "\u00A0as thing"
+    assert cm.node["ids"] == ["pkg0.C.cm"]
+
+    # Shared builds are only built once per session
+    assert trio_shared_build(srcdir) is trio_shared_build(srcdir)
+    assert trio_shared_build(srcdir) is not trio_shared_build(
+        srcdir, confoverrides={"trio_profile": True}
+    )
+    # ...and not inside the source directory
+    assert sorted(os.listdir(str(srcdir))) == [
+        "conf.py", "doc0.rst", "index.rst",
+    ]
+
+
+def test_persistent_sniff_cache(tmpdir, monkeypatch):
     shutil.copytree(str(Path(__file__).parent / "test-docs-source"),
                     str(tmpdir / "test-docs-source"))
+    cache_path = tmpdir / "doctrees" / _persist.SNIFF_CACHE_FILENAME
+
+    def build(*args):
+        # Sphinx 9 only runs our method documenter in legacy mode
+        subprocess.run(
+            ["sphinx-build", "-q", "-E", "-D", "autodoc_use_legacy_class_based=1", *args,
+             "-d", str(tmpdir / "doctrees"), "-b", "html",
+             str(tmpdir / "test-docs-source"), str(tmpdir / "out")],
+            check=True,
+        )
+
+    build()
+    with open(str(cache_path), "rb") as f:
+        fingerprint, entries = pickle.load(f)
+    stamp, sniffed = entries[("function", "autodoc_examples.asyncfn")]
+    assert sniffed == {"async"}
+    [(filename, _, _)] = stamp
+    assert filename.endswith("autodoc_examples.py")
+    assert entries[("method", "autodoc_examples.ExampleClass.classabstract")][1] == {
+        "abstractmethod", "classmethod",
+    }
 
-    subprocess.run(
-        ["sphinx-build", "-v", "-nW", "-D", "autodoc_member_order=bysource", "-nb", "html",
-         str(tmpdir / "test-docs-source"), str(tmpdir / "out")])
+    cache = _persist.PersistentSniffCache(str(cache_path))
+    cache.load()
+    assert cache.entries == entries
+    # Stale stamps are ignored
+    assert cache.lookup(
+        ("function", "autodoc_examples.asyncfn"), ["autodoc_examples"]
+    ) is None
 
-    tree = lxml.html.parse(str(tmpdir / "out" / "test.html")).getroot()
+    # The next build forgets objects that aren't documented any more
+    cache.update({("function", "autodoc_examples.gone"): (None, frozenset())})
+    cache.save()
+    build()
+    cache = _persist.PersistentSniffCache(str(cache_path))
+    cache.load()
+    assert ("function", "autodoc_examples.gone") not in cache.entries
+    assert cache.entries == entries
 
-    print("\n-- test case member order by source. --\n")
+    # Entries are stamped with the documented module as well as the one
+    # that defines the object, e.g. functools for partials
+    (tmpdir / "persist_examples.py").write_text("", "utf-8")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    import persist_examples  # noqa: F401
 
-    methods = (
-        tree.cssselect(r"#autodoc_examples\.ExampleClassForOrder")[0].getnext().cssselect("dt")
+    key = ("function", "persist_examples.fetch")
+    modnames = ["persist_examples", "functools"]
+    cache = _persist.PersistentSniffCache(str(tmpdir / "unit.pickle"))
+    assert len(cache.stamp(modnames)) == 2
+    cache.update({key: (cache.stamp(modnames), frozenset({"async"}))})
+    assert cache.lookup(key, modnames) == {"async"}
+    assert cache.lookup(key, ["functools"]) is None
+    cache.save()
+    st = os.stat(str(tmpdir / "persist_examples.py"))
+    os.utime(
+        str(tmpdir / "persist_examples.py"),
+        ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9),
     )
+    # Editing the documented module invalidates the entry, even though
+    # functools didn't change
+    cache = _persist.PersistentSniffCache(str(tmpdir / "unit.pickle"))
+    cache.load()
+    assert cache.lookup(key, modnames) is None
+
+    # Objects that aren't documented any more are forgotten
+    cache.dirty = False
+    cache.prune({"persist_examples.fetch"})
+    assert not cache.dirty
+    cache.prune({"persist_examples.other"})
+    assert cache.dirty and cache.entries == {}
+
+    # Changing the heuristics version invalidates everything
+    monkeypatch.setattr(_persist, "SNIFF_CACHE_VERSION", -1)
+    cache = _persist.PersistentSniffCache(str(cache_path))
+    cache.load()
+    assert cache.entries == {}
+
+    # Turning the cache off removes it
+    build("-D", "trio_sniff_cache=0")
+    assert not cache_path.exists()
+
+
+def write_multidoc_project(srcdir, conf="", ndocs=8):
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(
+        'extensions = ["sphinxcontrib_trio"]\n' + conf, "utf-8"
+    )
+    docnames = ["doc{}".format(i) for i in range(ndocs)]
+    (srcdir / "index.rst").write_text(
+        ".. toctree::\n\n" + "".join("   {}\n".format(d) for d in docnames),
+        "utf-8",
+    )
+    for i, docname in enumerate(docnames):
+        (srcdir / (docname + ".rst")).write_text(textwrap.dedent("""
+            {0}
+            =====
+
+            .. module:: pkg{1}
+
+            .. function:: afn(x)
+               :async:
+
+            .. function:: afn(x)
+               :noindex:
+               :for: item
+
+            .. class:: C
+
+               .. method:: cm()
+                  :classmethod:
+                  :with: thing
+        """.format(docname, i)), "utf-8")
+    return docnames
+
+
+def build_in_process(srcdir, outdir, doctreedir, buildername="html", parallel=2):
+    return build_docs(
+        srcdir, outdir, doctreedir=doctreedir, buildername=buildername,
+        parallel=parallel,
+    ).app
+
+
+def test_parallel_build_env_metadata(tmpdir):
+    srcdir = tmpdir / "src"
+    docnames = write_multidoc_project(srcdir)
+
+    def build():
+        return build_in_process(
+            srcdir, tmpdir / "out", tmpdir / "doctrees"
+        ).env
+
+    env = build()
+    assert sorted(env.trio_objects) == docnames
+    for i, docname in enumerate(docnames):
+        assert env.trio_objects[docname] == {
+            "pkg{}.afn".format(i): {
+                "objtype": "function",
+                "options": {"async": None},
+                "sniffed": None,
+                "noindex": False,
+            },
+            "pkg{}.C.cm".format(i): {
+                "objtype": "method",
+                "options": {"classmethod": None, "with": "thing"},
+                "sniffed": None,
+                "noindex": False,
+            },
+        }
+
+    # Re-reading a document replaces its records
+    (srcdir / "doc3.rst").write_text(textwrap.dedent("""
+        doc3
+        ====
+
+        .. function:: pkg3.newfn()
+           :async-for:
+    """), "utf-8")
+    env = build()
+    assert env.trio_objects["doc3"] == {
+        "pkg3.newfn": {
+            "objtype": "function",
+            "options": {"async-for": ""},
+            "sniffed": None,
+            "noindex": False,
+        },
+    }
+    assert "pkg2.afn" in env.trio_objects["doc2"]
+
+
+def test_profile(tmpdir):
+    srcdir = tmpdir / "src"
+    docnames = write_multidoc_project(srcdir, conf="trio_profile = True\n")
+    app = build_in_process(srcdir, tmpdir / "out", tmpdir / "doctrees")
+
+    with open(str(tmpdir / "out" / "sphinxcontrib_trio-trace.json")) as f:
+        trace = json.load(f)
+    events = [e for e in trace["traceEvents"] if e["name"] == "handle_signature"]
+    # Three signatures per document, collected from all the reader processes
+    assert len(events) == 3 * len(docnames)
+    assert {e["args"]["docname"] for e in events} == set(docnames)
+    stats, _ = _profile.summarize(app.env.trio_profile)
+    assert stats["handle_signature"]["count"] == 3 * len(docnames)
+    assert stats["handle_signature"]["p99_ms"] <= stats["handle_signature"]["max_ms"]
+    # Nearest-rank percentiles
+    assert _profile._percentile(list(range(1, 101)), 0.99) == 99
+    assert _profile._percentile(list(range(1, 201)), 0.99) == 198
+    assert _profile._percentile([5], 0.99) == 5
+
+    # Turning profiling off again drops the recorded events from the
+    # environment, even if some documents are re-read
+    conf = srcdir / "conf.py"
+    conf.write_text(
+        conf.read_text("utf-8").replace("trio_profile = True", ""), "utf-8"
+    )
+    (srcdir / "doc0.rst").write("\n", mode="a")
+    app = build_in_process(srcdir, tmpdir / "out", tmpdir / "doctrees")
+    assert not hasattr(app.env, "trio_profile")
+
+
+def test_signature_size(tmpdir, monkeypatch):
+    # Keeps an eye on how much our prefixes and suffixes add to the pickled
+    # doctrees and environment, by comparing against the same signatures
+    # without any of our options.
+    nsigs = 200
+    kinds = [":async:", ":with: thing", ":for: item", ":async-with:",
+             ":staticmethod:"]
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(
+        'extensions = ["sphinxcontrib_trio"]\n', "utf-8"
+    )
+    (srcdir / "index.rst").write_text(
+        "Index\n=====\n\n.. toctree::\n\n   plain\n   trio\n", "utf-8"
+    )
+    for docname, with_options in [("plain", False), ("trio", True)]:
+        lines = [docname, "=" * len(docname), ""]
+        for i in range(nsigs):
+            lines.append(".. method:: f{}(x)".format(i))
+            if with_options:
+                lines.append("   " + kinds[i % len(kinds)])
+            lines.append("")
+        (srcdir / (docname + ".rst")).write_text("\n".join(lines), "utf-8")
+
+    def per_sig(name):
+        app = build_in_process(
+            srcdir, tmpdir / name, tmpdir / (name + "-doctrees"), parallel=0
+        )
+        doctrees = tmpdir / (name + "-doctrees")
+        added = (doctrees / "trio.doctree").size() - (
+            doctrees / "plain.doctree"
+        ).size()
+        return app, added / nsigs
+
+    # Compare against giving every signature its own copy of the strings,
+    # like we used to, so this doesn't depend on the docutils version
+    def copied(make_node):
+        def node(options):
+            node = make_node(options)
+            if node is not None:
+                text = node.astext().encode().decode()
+                node = addnodes.desc_annotation(text, text)
+            return node
+        return node
+
+    import sphinxcontrib_trio
+
+    for name in ["prefix_node", "suffix_node"]:
+        monkeypatch.setattr(
+            sphinxcontrib_trio, name, copied(getattr(sphinxcontrib_trio, name))
+        )
+    _, copied_per_sig = per_sig("copied")
+    monkeypatch.undo()
+    app, shared_per_sig = per_sig("shared")
+    assert shared_per_sig < copied_per_sig
+
+    # Identical records are shared, so they pickle to almost nothing
+    per_record = len(pickle.dumps(app.env.trio_objects["trio"])) / nsigs
+    assert per_record < 20
+
+    # One text node per prefix or suffix
+    doctree = app.env.get_doctree("trio")
+    annotations = list(findall(doctree, addnodes.desc_annotation))
+    assert all(len(node.children) == 1 for node in annotations)
+    texts = {node.astext() for node in annotations}
+    assert "await " in texts
+    assert "\u00A0as thing" in texts
+
+
+def test_export_objects(tmpdir):
+    srcdir = tmpdir / "src"
+    docnames = write_multidoc_project(
+        srcdir, conf='trio_export_objects = "trio-objects.jsonl"\n', ndocs=3
+    )
+    build_in_process(srcdir, tmpdir / "out", tmpdir / "doctrees")
+
+    lines = (tmpdir / "out" / "trio-objects.jsonl").read_text("utf-8")
+    records = [json.loads(line) for line in lines.splitlines()]
+    # Sorted by name, and the indexed afn wins over the :noindex: one
+    assert [r["name"] for r in records] == [
+        name
+        for i in range(len(docnames))
+        for name in ["pkg{}.C.cm".format(i), "pkg{}.afn".format(i)]
+    ]
+    assert records[:2] == [
+        {
+            "name": "pkg0.C.cm",
+            "objtype": "method",
+            "options": {"classmethod": None, "with": "thing"},
+            "sniffed": None,
+            "docname": "doc0",
+        },
+        {
+            "name": "pkg0.afn",
+            "objtype": "function",
+            "options": {"async": None},
+            "sniffed": None,
+            "docname": "doc0",
+        },
+    ]
+
+    # Nothing is written unless asked for
+    write_multidoc_project(tmpdir / "src2", ndocs=1)
+    build_in_process(
+        tmpdir / "src2", tmpdir / "out2", tmpdir / "doctrees2", parallel=0
+    )
+    assert not list((tmpdir / "out2").listdir("*.jsonl"))
+
+
+def test_trio_inventory(tmpdir):
+    from sphinxcontrib_trio._inventory import load_inventory
+
+    # Project A documents some things and publishes its inventories...
+    write_multidoc_project(
+        tmpdir / "a", conf="trio_write_inventory = True\n", ndocs=2
+    )
+    build_in_process(tmpdir / "a", tmpdir / "a-out", tmpdir / "a-doctrees")
+    with open(str(tmpdir / "a-out" / "trio-objects.inv"), "rb") as f:
+        table = load_inventory(f.read())
+    # (the :noindex: afn isn't linkable, so it's left out)
+    assert table == {
+        "pkg0.afn": ("function", {"async": None}),
+        "pkg0.C.cm": ("method", {"classmethod": None, "with": "thing"}),
+        "pkg1.afn": ("function", {"async": None}),
+        "pkg1.C.cm": ("method", {"classmethod": None, "with": "thing"}),
+    }
+
+    # ...and project B links to them
+    base = str(tmpdir / "a-out")
+    srcdir = tmpdir / "b"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        extensions = ["sphinx.ext.intersphinx", "sphinxcontrib_trio"]
+        intersphinx_mapping = {{"a": ({0!r}, None)}}
+        trio_intersphinx_mapping = {{"a": ({0!r}, None)}}
+    """.format(base)), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        B
+        =
+
+        :func:`pkg0.afn` and :meth:`pkg1.C.cm`
+    """), "utf-8")
+    build_in_process(srcdir, tmpdir / "b-out", tmpdir / "b-doctrees")
+
+    tree = lxml.html.parse(str(tmpdir / "b-out" / "index.html")).getroot()
+    links = {
+        a.text_content(): a for a in tree.cssselect("a.reference.external")
+    }
+    afn = links["pkg0.afn()"]
+    assert afn.get("title").startswith("await pkg0.afn")
+    assert "trio-async" in afn.get("class").split()
+    cm = links["pkg1.C.cm()"]
+    assert cm.get("title").startswith("classmethod with pkg1.C.cm")
+    assert {"trio-classmethod", "trio-with"} <= set(cm.get("class").split())
+
+
+def test_sniff_workers(tmpdir):
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "isolated_mod.py").write_text(textwrap.dedent("""
+        import os
+        from contextlib import contextmanager
+
+        # Leave a trace of every process that imports us
+        here = os.path.dirname(os.path.abspath(__file__))
+        open(os.path.join(here, "imported-{}".format(os.getpid())), "w").close()
+
+        async def afn():
+            pass
+
+        class C:
+            @contextmanager
+            def cm(self):
+                yield
+    """), "utf-8")
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinx.ext.autodoc", "sphinxcontrib_trio"]
+        autodoc_use_legacy_class_based = True
+        # The build process only ever sees a mock...
+        autodoc_mock_imports = ["isolated_mod"]
+        # ...but the workers get the real thing
+        trio_sniff_workers = 1
+        trio_sniff_worker_max_imports = 1
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: isolated_mod.afn
+
+        .. automethod:: isolated_mod.C.cm
+    """), "utf-8")
+    app = build_in_process(srcdir, tmpdir / "out", tmpdir / "doctrees", parallel=0)
+
+    # The mocks would have sniffed as nothing
+    objects = app.env.trio_objects["index"]
+    assert objects["isolated_mod.afn"]["sniffed"] == ["async"]
+    assert objects["isolated_mod.C.cm"]["sniffed"] == ["with"]
+    # (Sphinx's ModuleAnalyzer imports the module into the build process
+    # too, to find its source, but that's out of our hands.)
+    importers = {p.basename for p in srcdir.listdir("imported-*")}
+    importers.discard("imported-{}".format(os.getpid()))
+    assert len(importers) == 1
+    assert build_state(app.env).sniff_pool is None
+
+    # A worker that hangs is given up on, and we sniff in the build process
+    (srcdir / "hanging_mod.py").write_text(textwrap.dedent("""
+        import sys
+        import time
+
+        main = sys.modules["__main__"]
+        spec = getattr(main, "__spec__", None)
+        if getattr(spec, "name", None) == "sphinxcontrib_trio._workers":
+            time.sleep(60)
+
+        async def afn():
+            pass
+
+        def gen():
+            yield
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: hanging_mod.afn
+
+        .. autofunction:: hanging_mod.gen
+
+        .. autofunction:: isolated_mod.afn
+    """), "utf-8")
+    build = build_docs(
+        srcdir, tmpdir / "out-hanging", freshenv=True, confoverrides={
+            "autodoc_mock_imports": [], "trio_sniff_worker_timeout": 1,
+        },
+    )
+    assert build.warnings.count("took more than 1 seconds") == 1
+    objects = build.env.trio_objects["index"]
+    assert objects["hanging_mod.afn"]["sniffed"] == ["async"]
+    assert objects["hanging_mod.gen"]["sniffed"] == ["for"]
+    assert objects["isolated_mod.afn"]["sniffed"] == ["async"]
+
+
+def test_inherited_members(tmpdir, monkeypatch):
+    from sphinxcontrib_trio import _autodoc
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+        # Sphinx 9 only runs our method documenter in legacy mode
+        autodoc_use_legacy_class_based = True
+    """), "utf-8")
+    (srcdir / "inherited_examples.py").write_text(textwrap.dedent("""
+        class Base:
+            async def fetch(self):
+                "Fetch the thing, at length."
+
+            @classmethod
+            def make(cls):
+                "Make one."
+
+        class A(Base):
+            pass
+
+        class B(A):
+            async def fetch(self):
+                "Fetch it differently."
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autoclass:: inherited_examples.Base
+           :members:
+
+        .. autoclass:: inherited_examples.A
+           :members:
+           :inherited-members:
+
+        .. autoclass:: inherited_examples.B
+           :members:
+           :inherited-members:
+    """), "utf-8")
+
+    sniffed = []
+    real_sniff = _autodoc.sniff_documented_object
+
+    def counting_sniff(self, obj):
+        sniffed.append(self.fullname)
+        return real_sniff(self, obj)
+
+    monkeypatch.setattr(_autodoc, "sniff_documented_object", counting_sniff)
+
+    def build(**confoverrides):
+        del sniffed[:]
+        return build_docs(
+            srcdir, tmpdir / "out", confoverrides=confoverrides, freshenv=True,
+        )
+
+    def entries(build):
+        found = {}
+        for sig in build.signatures("index"):
+            found[sig.fullname] = (sig.prefix, sig.node.parent[-1].astext())
+        return found
+
+    expected_objects = {
+        "inherited_examples.Base.fetch": ["async"],
+        "inherited_examples.Base.make": ["classmethod"],
+        "inherited_examples.A.fetch": ["async"],
+        "inherited_examples.A.make": ["classmethod"],
+        "inherited_examples.B.fetch": ["async"],
+        "inherited_examples.B.make": ["classmethod"],
+    }
+
+    plain = build()
+    objects = plain.env.trio_objects["index"]
+    assert {name: objects[name]["sniffed"] for name in objects} == expected_objects
+    # Base's two methods, plus B's own fetch
+    assert sorted(sniffed) == [
+        "inherited_examples.B.fetch",
+        "inherited_examples.Base.fetch",
+        "inherited_examples.Base.make",
+    ]
+    assert entries(plain)["inherited_examples.A.fetch"] == (
+        "await ", "Fetch the thing, at length.",
+    )
+
+    collapsed = build(trio_collapse_inherited=True)
+    objects = collapsed.env.trio_objects["index"]
+    assert {name: objects[name]["sniffed"] for name in objects} == expected_objects
+    found = entries(collapsed)
+    assert found["inherited_examples.Base.fetch"] == (
+        "await ", "Fetch the thing, at length.",
+    )
+    assert found["inherited_examples.A.fetch"] == (
+        "await ", "See inherited_examples.Base.fetch().",
+    )
+    assert found["inherited_examples.B.make"] == (
+        "classmethod ", "See inherited_examples.Base.make().",
+    )
+    # B overrides fetch, so that's not a repeat
+    assert found["inherited_examples.B.fetch"] == ("await ", "Fetch it differently.")
+    # The references point at the first entries
+    targets = {
+        ref["reftarget"]
+        for ref in findall(collapsed.doctree("index"), addnodes.pending_xref)
+    }
+    assert targets == {
+        "inherited_examples.Base.fetch", "inherited_examples.Base.make",
+    }
+
+    # Overrides go by each entry's own name, even when it's a repeat, and
+    # don't leak into the other entries for the same function
+    overridden = build(trio_option_overrides={
+        "inherited_examples.A.fetch": ["with"],
+        "inherited_examples.Base.make": ["staticmethod"],
+    })
+    assert {
+        name: prefix for name, (prefix, _) in entries(overridden).items()
+    } == {
+        "inherited_examples.Base.fetch": "await ",
+        "inherited_examples.Base.make": "staticmethod ",
+        "inherited_examples.A.fetch": "with ",
+        "inherited_examples.A.make": "classmethod ",
+        "inherited_examples.B.fetch": "await ",
+        "inherited_examples.B.make": "classmethod ",
+    }
+
+
+def test_options_resolved_event(tmpdir):
+    from sphinxcontrib_trio import get_trio_options, purge_trio_objects
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+        autodoc_use_legacy_class_based = True
+
+        import resolved_sink
+        from sphinxcontrib_trio import get_trio_options
+
+        def setup(app):
+            def record(app, obj, fullname, options):
+                resolved_sink.events.append((obj, fullname, options))
+                resolved_sink.lookups.append(get_trio_options(app.env, fullname))
+            app.connect("trio-options-resolved", record)
+    """), "utf-8")
+    (srcdir / "resolved_sink.py").write_text("events = []\nlookups = []\n", "utf-8")
+    (srcdir / "resolved_examples.py").write_text(textwrap.dedent("""
+        async def afn():
+            pass
+
+        class C:
+            @classmethod
+            def cm(cls):
+                "Make one."
+    """), "utf-8")
+    # autodoc imports these, then skips the ones that were imported from
+    # elsewhere
+    (srcdir / "leaky_examples.py").write_text(textwrap.dedent("""
+        from asyncio import sleep
+        from os.path import join
+
+        async def own():
+            "Defined here."
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: resolved_examples.afn
+
+        .. autoclass:: resolved_examples.C
+           :members:
+
+        .. function:: resolved_examples.manual()
+           :async-with: f
+
+        .. function:: resolved_examples.manual()
+           :noindex:
+           :for:
+
+        .. automodule:: leaky_examples
+           :members:
+
+        .. function:: sleep()
+    """), "utf-8")
+
+    build = build_docs(srcdir, tmpdir / "out")
+    import leaky_examples
+    import resolved_examples
+    import resolved_sink
+
+    assert resolved_sink.events == [
+        (resolved_examples.afn, "resolved_examples.afn", {"async": None}),
+        (resolved_examples.C.__dict__["cm"], "resolved_examples.C.cm",
+         {"classmethod": None}),
+        (None, "resolved_examples.manual", {"async-with": "f"}),
+        (None, "resolved_examples.manual", {"for": ""}),
+        (leaky_examples.own, "leaky_examples.own", {"async": None}),
+        # Nothing left over from autodoc's skipped import of sleep
+        (None, "leaky_examples.sleep", {}),
+    ]
+    # Looking objects up while reading sees each one as soon as it's noted
+    assert resolved_sink.lookups == [
+        {"async": None}, {"classmethod": None}, {"async-with": "f"},
+        {"async-with": "f"}, {"async": None}, {},
+    ]
+    assert build.env.trio_objects["index"]["leaky_examples.sleep"]["sniffed"] is None
+    state = build_state(build.env)
+    assert state.pending_sniffed == state.pending_objects == {}
+
+    env = build.env
+    assert get_trio_options(env, "resolved_examples.afn") == {"async": None}
+    assert get_trio_options(env, "resolved_examples.C.cm") == {
+        "classmethod": None,
+    }
+    # The indexed entry wins
+    assert get_trio_options(env, "resolved_examples.manual") == {
+        "async-with": "f",
+    }
+    assert get_trio_options(env, "resolved_examples.C") is None
+    # Callers get their own copy
+    get_trio_options(env, "resolved_examples.afn")["with"] = None
+    assert get_trio_options(env, "resolved_examples.afn") == {"async": None}
+    # The index follows changes to the records
+    purge_trio_objects(build.app, env, "index")
+    assert get_trio_options(env, "resolved_examples.afn") is None
+
+
+def test_option_overrides(tmpdir, monkeypatch):
+    from sphinx.errors import ConfigError
+    from sphinxcontrib_trio import _autodoc
+    from sphinxcontrib_trio._overrides import build_overrides
+
+    overrides = build_overrides({
+        "pkg.exact": ["async"],
+        "pkg.*": ["for"],
+        "pkg.sub.open_*": ["async-with"],
+        "pkg.sub.*": "with",
+        "pkg.sub.open_?": ["classmethod"],
+        "*.nothing": [],
+    })
+    assert overrides.lookup("pkg.exact") == {"async"}
+    assert overrides.lookup("pkg.other") == {"for"}
+    # More literal components win...
+    assert overrides.lookup("pkg.sub.thing") == {"with"}
+    # ...and between equal ones, the first listed
+    assert overrides.lookup("pkg.sub.open_x") == {"async-with"}
+    assert overrides.lookup("other.nothing") == set()
+    assert overrides.lookup("other.something") is None
+    with pytest.raises(ConfigError):
+        build_overrides({"pkg.f": ["asink"]})
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+        autodoc_use_legacy_class_based = True
+        trio_option_overrides_file = "overrides.toml"
+        trio_option_overrides = {"override_examples.fn": ["async-for"]}
+    """), "utf-8")
+    (srcdir / "overrides.toml").write_text(textwrap.dedent("""
+        "override_examples.fn" = ["for"]
+        "override_examples.C.*" = ["async-with"]
+    """), "utf-8")
+    (srcdir / "override_examples.py").write_text(textwrap.dedent("""
+        def fn():
+            "Really a plain function."
+
+        class C:
+            def meth(self):
+                "So is this."
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: override_examples.fn
+
+        .. autoclass:: override_examples.C
+           :members:
+    """), "utf-8")
+
+    def no_sniffing(*args):  # pragma: no cover
+        raise AssertionError("sniffed an overridden object")
+
+    monkeypatch.setattr(_autodoc, "_sniff_member", no_sniffing)
+    monkeypatch.setattr(_autodoc, "sniff_options_static", no_sniffing)
+    build = build_docs(srcdir, tmpdir / "out")
+    objects = build.env.trio_objects["index"]
+    # conf.py wins over the file
+    assert objects["override_examples.fn"]["sniffed"] == ["async-for"]
+    assert objects["override_examples.C.meth"]["sniffed"] == ["async-with"]
+    assert build.signature_prefixes("index") == [
+        ("override_examples.fn", "async for ... in "),
+        ("override_examples.C.meth", "async with "),
+    ]
+
+    # The lint builder doesn't need to import anything they cover
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        extensions = ["sphinxcontrib_trio"]
+        trio_option_overrides_file = "overrides.json"
+    """), "utf-8")
+    (srcdir / "overrides.json").write_text(
+        '{"not_importable.fn": ["async"]}', "utf-8"
+    )
+    (srcdir / "index.rst").write_text(
+        ".. function:: not_importable.fn()\n", "utf-8"
+    )
+    build = build_docs(srcdir, tmpdir / "lint", buildername="trio-lint")
+    assert [m["name"] for m in build.app.builder.mismatches] == [
+        "not_importable.fn",
+    ]
+
+
+def test_trio_lint(tmpdir):
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+    """), "utf-8")
+    (srcdir / "lint_examples.py").write_text(textwrap.dedent("""
+        import contextlib
+        import functools
+
+        async def afn():
+            pass
+
+        def gen():
+            yield
+
+        @contextlib.asynccontextmanager
+        async def acm():
+            yield
+
+        def opaque(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                return fn(*args, **kwargs)
+            del wrapper.__wrapped__
+            return wrapper
+
+        @opaque
+        async def hidden():
+            pass
+
+        class C:
+            @classmethod
+            def cm(cls):
+                pass
+
+            async def meth(self):
+                pass
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. module:: lint_examples
+
+        .. function:: afn()
+
+        .. function:: gen()
+           :async-for:
+
+        .. autofunction:: acm
+           :no-auto-options:
+
+        .. function:: hidden()
+           :async:
+
+        .. class:: C
+
+           .. method:: cm()
+
+           .. method:: meth()
+              :async:
+
+        .. function:: not_a_module.fn()
+           :async:
+    """), "utf-8")
+
+    build = build_docs(srcdir, tmpdir / "out", buildername="trio-lint")
+    mismatches = {m["name"]: m for m in build.app.builder.mismatches}
+    assert sorted(mismatches) == [
+        "lint_examples.C.cm", "lint_examples.acm", "lint_examples.afn",
+        "lint_examples.gen",
+    ]
+    assert mismatches["lint_examples.afn"] == {
+        "name": "lint_examples.afn",
+        "docname": "index",
+        "objtype": "function",
+        "documented": [],
+        "sniffed": ["async"],
+        "missing": ["async"],
+        "unconfirmed": [],
+    }
+    assert mismatches["lint_examples.gen"]["missing"] == ["for"]
+    assert mismatches["lint_examples.gen"]["unconfirmed"] == ["async-for"]
+    assert mismatches["lint_examples.acm"]["missing"] == ["async-with"]
+    assert mismatches["lint_examples.C.cm"]["missing"] == ["classmethod"]
+    assert (
+        "lint_examples.gen is documented as :async-for:, but sniffs as :for:"
+        in build.warnings
+    )
+    assert build.warnings.count("[trio.lint]") == 4
+    # Nothing gets written
+    assert os.listdir(build.outdir) == [".doctrees"]
+
+
+def test_prefetch_imports(tmpdir, monkeypatch):
+    import time
+    from sphinxcontrib_trio._prefetch import modules_to_prefetch, prefetch_modules
+
+    assert modules_to_prefetch(textwrap.dedent("""
+        .. automodule:: pkg.a
+
+        .. autofunction:: pkg.b.fn(x, y)
+
+        .. module:: pkg.c
+
+        .. autoclass:: Thing
+
+        .. py:automethod:: pkg.d::Cls.meth
+
+        .. currentmodule:: None
+
+        .. autofunction:: lonely
+    """)) == {"pkg.a", "pkg.b", "pkg.c", "pkg.d.Cls"}
+
+    libdir = tmpdir / "lib"
+    libdir.mkdir()
+    for i in range(4):
+        (libdir / "prefetch_slow_{}.py".format(i)).write_text(textwrap.dedent("""
+            import time
+            time.sleep(0.3)
+
+            class Thing:
+                pass
+        """), "utf-8")
+    (libdir / "prefetch_broken.py").write_text("1 / 0\n", "utf-8")
+    (libdir / "prefetch_stuck.py").write_text(
+        "import time\ntime.sleep(1.5)\n", "utf-8"
+    )
+    monkeypatch.syspath_prepend(str(libdir))
+
+    start = time.monotonic()
+    errors, timed_out = prefetch_modules(
+        ["prefetch_slow_{}".format(i) for i in range(4)]
+        + ["prefetch_slow_0.Thing", "prefetch_broken", "prefetch_stuck"],
+        threads=6, timeout=0.8,
+    )
+    elapsed = time.monotonic() - start
+    # The slow imports overlapped, and we didn't wait for the stuck one
+    assert elapsed < 1.2
+    assert sorted(errors) == ["prefetch_broken"]
+    assert isinstance(errors["prefetch_broken"], ZeroDivisionError)
+    assert timed_out == ["prefetch_stuck"]
+    for i in range(4):
+        assert "prefetch_slow_{}".format(i) in sys.modules
+
+    # Before forking parallel readers, we wait for the stragglers
+    (libdir / "prefetch_straggler.py").write_text(
+        "import time\ntime.sleep(0.5)\n", "utf-8"
+    )
+    errors, timed_out = prefetch_modules(
+        ["prefetch_straggler"], threads=1, timeout=0.1, finish=True,
+    )
+    assert timed_out == ["prefetch_straggler"]
+    assert "prefetch_straggler" in sys.modules
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autodoc"]
+        trio_prefetch_imports = 2
+        autodoc_mock_imports = ["no_such_dependency"]
+    """), "utf-8")
+    (libdir / "prefetch_uses_mock.py").write_text(textwrap.dedent("""
+        import no_such_dependency
+
+        async def afn():
+            pass
+    """), "utf-8")
+    (libdir / "prefetch_broken_too.py").write_text("1 / 0\n", "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. autofunction:: prefetch_uses_mock.afn
+
+        .. automodule:: prefetch_broken_too
+    """), "utf-8")
+    build = build_docs(srcdir, tmpdir / "out")
+    assert "prefetch_uses_mock" in sys.modules
+    assert build.signature_prefixes("index") == [
+        ("prefetch_uses_mock.afn", "await "),
+    ]
+    # Only autodoc reports the broken module
+    assert "prefetching" not in build.warnings
+    assert build.warnings.count("failed to import") == 1
+
+
+def test_cache_registry(tmpdir):
+    from sphinx.errors import ConfigError
+    from sphinxcontrib_trio._cache import (
+        LRUCache, WeakIdentityCache, cache_report, _registry,
+    )
+
+    cache = LRUCache(maxsize=2)
+    cache.store("a", 1)
+    cache.store("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used
+    cache.store("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.info() == (2, 1, 2)
+    assert cache.setdefault("a", 10) == 1
+    cache.resize(1)
+    assert len(cache) == 1
+
+    class Thing:
+        pass
+
+    things = [Thing() for _ in range(3)]
+    weak = WeakIdentityCache(maxsize=2)
+    for i, thing in enumerate(things):
+        weak.store(thing, i)
+    assert len(weak) == 2
+    assert weak.get(things[0]) is None
+    assert weak.get(things[2]) == 2
+    del thing, things[:]
+    gc.collect()
+    assert len(weak) == 0
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        extensions = ["sphinxcontrib_trio"]
+        trio_cache_limits = {"prefix_strings": 1}
+        trio_cache_report = True
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. function:: afn()
+           :async:
+
+        .. function:: agen()
+           :async-for:
+    """), "utf-8")
+    try:
+        build = build_docs(srcdir, tmpdir / "out")
+        assert _registry["prefix_strings"][0].maxsize == 1
+        assert [name for name, _, _ in cache_report()] == [
+            "annotations", "class_attributes", "option_lines",
+            "prefix_strings", "shared_records", "sniff_options",
+            "sniff_table", "static_tables",
+        ]
+        assert "sphinxcontrib_trio cache prefix_strings: 1/1 entries" in (
+            build.status
+        )
+
+        # Caches of facts about imported objects are emptied when documents
+        # are about to be re-read
+        def fn():  # pragma: no cover
+            pass
+
+        sniff_options(fn)
+        sniffed = _registry["sniff_options"][0]
+        assert len(sniffed) > 0
+        (srcdir / "index.rst").write_text("Changed\n=======\n", "utf-8")
+        build_docs(srcdir, tmpdir / "out")
+        assert len(sniffed) == 0
+        # Dropping a limit from conf.py puts the default back
+        (srcdir / "conf.py").write_text(
+            'extensions = ["sphinxcontrib_trio"]\n', "utf-8"
+        )
+        build_docs(srcdir, tmpdir / "out")
+        assert _registry["prefix_strings"][0].maxsize == 1000
+
+        (srcdir / "conf.py").write_text(textwrap.dedent("""
+            extensions = ["sphinxcontrib_trio"]
+            trio_cache_limits = {"no_such_cache": 10}
+        """), "utf-8")
+        with pytest.raises(ConfigError):
+            build_docs(srcdir, tmpdir / "out")
+    finally:
+        for cache, _, default in _registry.values():
+            cache.resize(default)
+
+
+def test_autosummary(tmpdir, monkeypatch):
+    from sphinxcontrib_trio import _autosummary
+
+    srcdir = tmpdir / "src"
+    srcdir.mkdir()
+    (srcdir / "conf.py").write_text(textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, os.path.abspath("."))
+        extensions = ["sphinxcontrib_trio", "sphinx.ext.autosummary"]
+        autodoc_use_legacy_class_based = True
+        autosummary_generate = True
+        trio_option_overrides = {"summary_examples.overridden": ["for"]}
+    """), "utf-8")
+    (srcdir / "summary_examples.py").write_text(textwrap.dedent("""
+        import contextlib
+
+        async def fetch():
+            "Fetch things."
+
+        async def documented():
+            "Documented below, with more options."
+
+        @contextlib.asynccontextmanager
+        async def open_thing():
+            "Open a thing."
+            yield
+
+        def overridden():
+            "Overridden."
+
+        class Thing:
+            "A thing."
+
+            async def method(self):
+                "A method."
+    """), "utf-8")
+    (srcdir / "index.rst").write_text(textwrap.dedent("""
+        .. toctree::
+
+           other
+
+        .. currentmodule:: summary_examples
+
+        .. autosummary::
+
+           fetch
+           documented
+           open_thing
+           overridden
+
+        .. autosummary::
+           :toctree: generated
+
+           Thing
+    """), "utf-8")
+    (srcdir / "other.rst").write_text(textwrap.dedent("""
+        Other
+        =====
+
+        .. function:: summary_examples.documented()
+           :async-with: conn
+    """), "utf-8")
+
+    sniffed = []
+    real_sniff = _autosummary.sniff_options
+
+    def counting_sniff(obj):
+        sniffed.append(obj.__name__)
+        return real_sniff(obj)
+
+    monkeypatch.setattr(_autosummary, "sniff_options", counting_sniff)
+    build = build_docs(srcdir, tmpdir / "out")
+    # other.rst is read after index.rst, so documented() got sniffed just in
+    # case, but the override and the class never are
+    assert sorted(sniffed) == ["documented", "fetch", "method", "open_thing"]
+
+    tree = lxml.html.parse(str(tmpdir / "out" / "index.html")).getroot()
+    def rows(tree):
+        return [
+            row.cssselect("td")[0].text_content().replace("\u00A0", " ")
+            for row in tree.cssselect("table.autosummary tr")
+        ]
+
+    assert rows(tree) == [
+        "await fetch()",
+        # The options it was documented with win over what was sniffed
+        "async with documented() as conn",
+        "async with open_thing()",
+        "for ... in overridden()",
+        "Thing()",
+    ]
+    # Including the tables in pages generated by autosummary_generate
+    stub = lxml.html.parse(
+        str(tmpdir / "out" / "generated" / "summary_examples.Thing.html")
+    ).getroot()
+    assert rows(stub) == ["__init__()", "await method()"]
+    assert "trio" not in build.warnings
+
+    # Before Sphinx 3.2, autosummary doesn't tell us what it imported, so we
+    # look the objects up again
+    from sphinx.ext.autosummary import Autosummary
+
+    monkeypatch.setattr(_autosummary, "_RECORDS_IMPORTS", False)
+    monkeypatch.setattr(
+        _autosummary.TrioAutosummary, "import_by_name",
+        Autosummary.import_by_name,
+    )
+    build_docs(srcdir, tmpdir / "out2", freshenv=True)
+    tree = lxml.html.parse(str(tmpdir / "out2" / "index.html")).getroot()
+    assert rows(tree)[:4] == [
+        "await fetch()", "async with documented() as conn",
+        "async with open_thing()", "for ... in overridden()",
+    ]
+
+
+# Our own share of the import time, once Sphinx itself is loaded, in
+# microseconds.
+IMPORT_TIME_BUDGET_US = 50000
+
+
+def test_import_time():
+    code = textwrap.dedent("""\
+        import sys
+        import sphinx.application, sphinx.domains.python
+        import sphinxcontrib_trio
+        deferred = ["sphinx.ext.autodoc", "sphinxcontrib_trio._autodoc",
+                    "sphinxcontrib_trio._lint", "tomllib", "tomli",
+                    "contextlib2", "async_generator"]
+        print([name for name in deferred if name in sys.modules])
+    """)
+
+    def measure():
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True,
+        )
+        # Lines look like "import time: self | cumulative | name"
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == "sphinxcontrib_trio":
+                return result.stdout.strip(), int(fields[1])
+        assert False, result.stderr  # pragma: no cover
 
-    names = [method.get("id").split(".")[-1] for method in methods]
+    imported, _ = measure()
+    assert imported == "[]"
+    # Timings are noisy, so take the best of a few runs
+    assert min(measure()[1] for _ in range(3)) < IMPORT_TIME_BUDGET_US
 
-    assert names == ["d_asyncmethod", "a_syncmethod", "c_asyncmethod", "b_syncmethod"]
+    # But the lazy names still work
+    import sphinxcontrib_trio
+    assert sphinxcontrib_trio.ExtendedFunctionDocumenter.priority > 0
+    assert sphinxcontrib_trio.CM_CODES
+    with pytest.raises(AttributeError):
+        sphinxcontrib_trio.no_such_thing